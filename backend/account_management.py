@@ -1,10 +1,11 @@
 import os
+import asyncio
 import logging
 import secrets
 from datetime import datetime, timedelta
 from fastapi import HTTPException, status
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import List, Optional
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -42,9 +43,10 @@ class PrivacySettings(BaseModel):
 class AccountSecurityService:
     """Service for managing account security features"""
 
-    def __init__(self, db):
+    def __init__(self, db, auth_cache=None):
         self.db = db
         self.email_service = EmailService()
+        self.auth_cache = auth_cache
 
     async def send_email_verification(self, user_email: str) -> dict:
         """Send email verification token and code"""
@@ -76,7 +78,7 @@ class AccountSecurityService:
             return {"message": "Verification email sent", "expires_in": "24 hours"}
 
         except Exception as e:
-            logger.error(f"Error sending verification email: {str(e)}")
+            logger.error("Error sending verification email: %s", e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to send verification email",
@@ -116,8 +118,8 @@ class AccountSecurityService:
                 {"$set": {"is_used": True, "verified_at": datetime.utcnow()}},
             )
 
-            # Update user as verified
-            await self.db.users.update_one(
+            # Update user as verified, dropping their cached auth record
+            user = await self.db.users.find_one_and_update(
                 {"email": email},
                 {
                     "$set": {
@@ -125,7 +127,10 @@ class AccountSecurityService:
                         "email_verified_at": datetime.utcnow(),
                     }
                 },
+                projection={"_id": 0, "id": 1},
             )
+            if user and self.auth_cache is not None:
+                await self.auth_cache.invalidate(user["id"])
 
             return {
                 "message": "Email verified successfully",
@@ -140,7 +145,7 @@ class AccountSecurityService:
                 )
             raise
         except Exception as e:
-            logger.error(f"Error verifying email: {str(e)}")
+            logger.error("Error verifying email: %s", e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Email verification failed",
@@ -154,28 +159,22 @@ class AccountSecurityService:
             if not user:
                 raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
 
-            # Get all related data
-            decisions = await self.db.decision_sessions.find(
-                {"user_id": user_id}
-            ).to_list(None)
-            conversations = await self.db.conversations.find(
-                {"user_id": user_id}
-            ).to_list(None)
-            payments = await self.db.payments.find({"user_id": user_id}).to_list(None)
-            subscriptions = await self.db.subscriptions.find(
-                {"user_id": user_id}
-            ).to_list(None)
-            shares = await self.db.decision_shares.find({"user_id": user_id}).to_list(
-                None
-            )
-
-            # Clean up ObjectIds and sensitive data
+            # Get all related data, cleaning ObjectIds and sensitive fields
+            # batch by batch rather than loading each collection first
             user_export = self._clean_export_data(user)
-            decisions_export = [self._clean_export_data(d) for d in decisions]
-            conversations_export = [self._clean_export_data(c) for c in conversations]
-            payments_export = [self._clean_export_data(p) for p in payments]
-            subscriptions_export = [self._clean_export_data(s) for s in subscriptions]
-            shares_export = [self._clean_export_data(sh) for sh in shares]
+            decisions_export = await self._export_collection(
+                self.db.decision_sessions, user_id
+            )
+            conversations_export = await self._export_collection(
+                self.db.conversations, user_id
+            )
+            payments_export = await self._export_collection(self.db.payments, user_id)
+            subscriptions_export = await self._export_collection(
+                self.db.subscriptions, user_id
+            )
+            shares_export = await self._export_collection(
+                self.db.decision_shares, user_id
+            )
 
             export_data = {
                 "export_info": {
@@ -190,12 +189,12 @@ class AccountSecurityService:
                 "subscriptions": subscriptions_export,
                 "shared_decisions": shares_export,
                 "summary": {
-                    "total_decisions": len(decisions),
-                    "total_conversations": len(conversations),
-                    "total_payments": len(payments),
+                    "total_decisions": len(decisions_export),
+                    "total_conversations": len(conversations_export),
+                    "total_payments": len(payments_export),
                     "account_created": user.get("created_at"),
                     "last_active": max(
-                        [d.get("last_active", datetime.min) for d in decisions]
+                        [d.get("last_active", datetime.min) for d in decisions_export]
                         + [datetime.min]
                     ),
                 },
@@ -204,7 +203,7 @@ class AccountSecurityService:
             return export_data
 
         except Exception as e:
-            logger.error(f"Error exporting user data: {str(e)}")
+            logger.error("Error exporting user data: %s", e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Data export failed",
@@ -223,7 +222,9 @@ class AccountSecurityService:
             # Verify password
             from server import verify_password  # Import from main server
 
-            if not verify_password(password, user["password_hash"]):
+            if not await asyncio.to_thread(
+                verify_password, password, user["password_hash"]
+            ):
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password"
                 )
@@ -291,12 +292,19 @@ class AccountSecurityService:
             }
 
         except Exception as e:
-            logger.error(f"Error deleting user account: {str(e)}")
+            logger.error("Error deleting user account: %s", e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Account deletion failed",
             )
 
+    async def _export_collection(self, collection, user_id: str) -> List[dict]:
+        """A user's cleaned documents from one collection"""
+        return [
+            self._clean_export_data(doc)
+            async for doc in collection.find({"user_id": user_id}, {"_id": 0})
+        ]
+
     def _clean_export_data(self, data: dict) -> dict:
         """Clean data for export (remove sensitive info and ObjectIds)"""
         if not data:
@@ -345,7 +353,7 @@ class AccountSecurityService:
         await self.db.audit_logs.insert_one(log_entry)
 
         # Also log to file
-        logger.warning(f"Account deleted: user_id={user_id}, email={email}")
+        logger.warning("Account deleted: user_id=%s, email=%s", user_id, email)
 
 
 class EmailService:
@@ -438,8 +446,8 @@ class EmailService:
                 server.login(self.smtp_username, self.smtp_password)
                 server.send_message(msg)
 
-            logger.info(f"Email sent successfully to {to_email}")
+            logger.info("Email sent successfully to %s", to_email)
 
         except Exception as e:
-            logger.error(f"Failed to send email to {to_email}: {str(e)}")
+            logger.error("Failed to send email to %s: %s", to_email, e)
             # Don't raise exception - email failures shouldn't break the app
@@ -113,7 +113,7 @@ Respond with exactly one word: STRUCTURED, INTUITIVE, or MIXED."""
                 return DecisionType.MIXED
                 
         except Exception as e:
-            logger.error(f"Classification error: {e}")
+            logger.error("Classification error: %s", e)
             return DecisionType.MIXED
 
     def select_models(self, decision_type: DecisionType) -> List[str]:
@@ -192,7 +192,7 @@ Make questions specific to their situation and include practical nudges."""
                 return self._extract_questions_from_text(response, decision_type)
                 
         except Exception as e:
-            logger.error(f"Follow-up generation error: {e}")
+            logger.error("Follow-up generation error: %s", e)
             return self._generate_fallback_questions(initial_question, decision_type)
 
     def _extract_questions_from_text(self, text: str, decision_type: DecisionType) -> List[FollowUpQuestion]:
@@ -338,7 +338,7 @@ User Responses:
             return self._parse_synthesis_response(response, [model], decision_type)
             
         except Exception as e:
-            logger.error(f"Synthesis error: {e}")
+            logger.error("Synthesis error: %s", e)
             return self._generate_fallback_recommendation(context, [model], decision_type)
 
     async def _multi_model_synthesis(
@@ -366,7 +366,7 @@ User Responses:
                 )
                 model_responses[model] = response
             except Exception as e:
-                logger.error(f"Model {model} synthesis error: {e}")
+                logger.error("Model %s synthesis error: %s", model, e)
                 continue
         
         # Generate consensus using Claude as synthesizer
@@ -401,7 +401,7 @@ User Responses:
                 )
                 return self._parse_synthesis_response(consensus_response, models, decision_type)
             except Exception as e:
-                logger.error(f"Consensus synthesis error: {e}")
+                logger.error("Consensus synthesis error: %s", e)
                 
         # Fallback to single best response
         if model_responses:
@@ -498,7 +498,7 @@ Provide insights that go beyond conventional analysis."""
             )
             
         except (json.JSONDecodeError, KeyError) as e:
-            logger.error(f"Response parsing error: {e}")
+            logger.error("Response parsing error: %s", e)
             return self._generate_fallback_recommendation("", models_used, decision_type)
 
     def _generate_fallback_recommendation(
@@ -36,11 +36,6 @@ class SmartClassification:
     routed_models: List[str]
     cost_estimate: str
 
-class DecisionType(Enum):
-    STRUCTURED = "structured"
-    INTUITIVE = "intuitive"
-    MIXED = "mixed"
-
 @dataclass
 class FollowUpQuestion:
     question: str
@@ -83,6 +78,14 @@ class AIOrchestrator:
         self.followup_engine = followup_engine
         self.classification_cache = {}
         
+        # Which optional components were wired in, fixed for the instance's lifetime
+        self.component_status = {
+            "llm_router_available": llm_router is not None,
+            "classifier_available": classifier is not None,
+            "smart_router_available": smart_router is not None,
+            "followup_engine_available": followup_engine is not None
+        }
+        
         # Enhanced personas for follow-up questions
         self.followup_personas = {
             "realist": {
@@ -140,7 +143,7 @@ class AIOrchestrator:
             return smart_classification
             
         except Exception as e:
-            logger.error(f"Smart classification failed: {str(e)}")
+            logger.error("Smart classification failed: %s", e)
             # Return safe fallback
             return SmartClassification(
                 complexity=ComplexityLevel.MEDIUM,
@@ -196,7 +199,7 @@ Respond with exactly one word: STRUCTURED, INTUITIVE, or MIXED."""
                     return decision_type
                         
         except Exception as e:
-            logger.error(f"Classification error: {e}")
+            logger.error("Classification error: %s", e)
             
         # Default fallback based on keywords
         question_lower = question.lower()
@@ -291,7 +294,7 @@ Adapt your question style based on their response:
                 return await self._generate_legacy_followups(initial_question, classification, max_questions)
                 
         except Exception as e:
-            logger.error(f"Smart followup generation failed: {str(e)}")
+            logger.error("Smart followup generation failed: %s", e)
             return await self._generate_legacy_followups(initial_question, classification, max_questions)
 
     async def _generate_legacy_followups(
@@ -379,7 +382,7 @@ Make questions specific to their situation and include practical nudges."""
                     return self._extract_questions_from_text(response, decision_type)
                     
         except Exception as e:
-            logger.error(f"Follow-up generation error: {e}")
+            logger.error("Follow-up generation error: %s", e)
             
         return self._generate_fallback_questions(initial_question, decision_type)
 
@@ -558,7 +561,7 @@ User Responses:
                 return self._generate_fallback_recommendation(context, [model], decision_type)
                 
         except Exception as e:
-            logger.error(f"Synthesis error: {e}")
+            logger.error("Synthesis error: %s", e)
             return self._generate_fallback_recommendation(context, [model], decision_type)
 
     def _get_decision_type_guidance(self, decision_type: DecisionType) -> str:
@@ -622,7 +625,7 @@ User Responses:
             )
             
         except (json.JSONDecodeError, KeyError) as e:
-            logger.error(f"Response parsing error: {e}")
+            logger.error("Response parsing error: %s", e)
             return self._generate_fallback_recommendation("", models_used, decision_type)
 
     def _generate_fallback_recommendation(
@@ -683,5 +686,5 @@ def create_ai_orchestrator(llm_router):
         )
     except ImportError as e:
         # Fallback to basic orchestrator if smart systems not available
-        logger.warning(f"Smart systems not available, using basic orchestrator: {e}")
+        logger.warning("Smart systems not available, using basic orchestrator: %s", e)
         return AIOrchestrator(llm_router=llm_router)
\ No newline at end of file
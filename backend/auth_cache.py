@@ -0,0 +1,96 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional
+import bson
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds a looked-up user stays cached; 0 disables the cache
+AUTH_CACHE_TTL = int(os.environ.get("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_MAX_ENTRIES = 10000
+
+class AuthCache:
+    """Short-lived cache of user documents loaded during authentication
+
+    Uses Redis when a URL is given so invalidations reach every worker, and an
+    in-process TTL map otherwise. Callers must invalidate a user after writing
+    to their document.
+    """
+
+    def __init__(self, ttl: int = AUTH_CACHE_TTL, redis_url: Optional[str] = None, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = OrderedDict()  # user_id -> (expires_at, user)
+        self.redis = None
+
+        if redis_url:
+            if redis_asyncio is None:
+                logger.warning("REDIS_URL is set but redis is not installed; using in-process auth cache")
+            else:
+                self.redis = redis_asyncio.from_url(redis_url)
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"auth:user:{user_id}"
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        """Return a copy of the cached user, or None on a miss"""
+        if self.ttl <= 0:
+            return None
+
+        if self.redis is not None:
+            try:
+                data = await self.redis.get(self._key(user_id))
+            except Exception as e:
+                logger.warning("Auth cache read failed: %s", e)
+                return None
+            # BSON keeps datetimes and ObjectIds exactly as Mongo returned them
+            return bson.decode(data) if data else None
+
+        entry = self._local.get(user_id)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._local.pop(user_id, None)
+            return None
+        # Handlers update the user dict in place, so never hand out the cached one
+        return dict(user)
+
+    async def set(self, user_id: str, user: dict):
+        """Cache a user document for ttl seconds"""
+        if self.ttl <= 0:
+            return
+
+        if self.redis is not None:
+            try:
+                await self.redis.set(self._key(user_id), bson.encode(user), ex=self.ttl)
+            except Exception as e:
+                logger.warning("Auth cache write failed: %s", e)
+            return
+
+        self._local[user_id] = (time.monotonic() + self.ttl, dict(user))
+        self._local.move_to_end(user_id)
+        if len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    async def invalidate(self, user_id: str):
+        """Drop a user so the next request reloads it from the database"""
+        self._local.pop(user_id, None)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(self._key(user_id))
+            except Exception as e:
+                logger.warning("Auth cache invalidation failed: %s", e)
+
+    async def close(self):
+        """Release the Redis connection pool"""
+        if self.redis is not None:
+            await self.redis.aclose()
@@ -46,10 +46,10 @@ class EmailService:
             )
 
             await self._send_email(to_email, subject, html_content)
-            logger.info(f"Verification email sent successfully to {to_email}")
+            logger.info("Verification email sent successfully to %s", to_email)
 
         except Exception as e:
-            logger.error(f"Failed to send verification email to {to_email}: {str(e)}")
+            logger.error("Failed to send verification email to %s: %s", to_email, e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to send verification email",
@@ -67,10 +67,10 @@ class EmailService:
             )
 
             await self._send_email(to_email, subject, html_content)
-            logger.info(f"Password reset email sent successfully to {to_email}")
+            logger.info("Password reset email sent successfully to %s", to_email)
 
         except Exception as e:
-            logger.error(f"Failed to send password reset email to {to_email}: {str(e)}")
+            logger.error("Failed to send password reset email to %s: %s", to_email, e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to send password reset email",
@@ -86,10 +86,10 @@ class EmailService:
             )
 
             await self._send_email(to_email, subject, html_content)
-            logger.info(f"Welcome email sent successfully to {to_email}")
+            logger.info("Welcome email sent successfully to %s", to_email)
 
         except Exception as e:
-            logger.error(f"Failed to send welcome email to {to_email}: {str(e)}")
+            logger.error("Failed to send welcome email to %s: %s", to_email, e)
             # Don't raise exception for welcome emails - they're not critical
 
     async def send_security_alert(
@@ -104,10 +104,10 @@ class EmailService:
             )
 
             await self._send_email(to_email, subject, html_content)
-            logger.info(f"Security alert sent successfully to {to_email}")
+            logger.info("Security alert sent successfully to %s", to_email)
 
         except Exception as e:
-            logger.error(f"Failed to send security alert to {to_email}: {str(e)}")
+            logger.error("Failed to send security alert to %s: %s", to_email, e)
             # Don't raise exception for security alerts - they shouldn't break the flow
 
     async def send_billing_notification(
@@ -134,11 +134,13 @@ class EmailService:
 
             await self._send_email(to_email, subject, html_content)
             logger.info(
-                f"Billing notification ({notification_type}) sent successfully to {to_email}"
+                "Billing notification (%s) sent successfully to %s",
+                notification_type,
+                to_email,
             )
 
         except Exception as e:
-            logger.error(f"Failed to send billing notification to {to_email}: {str(e)}")
+            logger.error("Failed to send billing notification to %s: %s", to_email, e)
             # Don't raise exception for billing notifications
 
     async def _send_email(self, to_email: str, subject: str, html_content: str):
@@ -168,10 +170,10 @@ class EmailService:
                 server.login(self.smtp_username, self.smtp_password)
                 server.send_message(msg)
 
-            logger.info(f"Email sent successfully to {to_email}")
+            logger.info("Email sent successfully to %s", to_email)
 
         except Exception as e:
-            logger.error(f"SMTP error sending email to {to_email}: {str(e)}")
+            logger.error("SMTP error sending email to %s: %s", to_email, e)
             raise
 
     def _create_verification_email_template(
@@ -455,9 +457,26 @@ class EmailService:
 class EmailVerificationService:
     """Service for managing email verification"""
 
-    def __init__(self, db, email_service):
+    def __init__(self, db, email_service, auth_cache=None):
         self.db = db
         self.email_service = email_service
+        self.auth_cache = auth_cache
+
+    async def _mark_email_verified(self, email: str) -> bool:
+        """Mark a user verified and drop their cached auth record"""
+        user = await self.db.users.find_one_and_update(
+            {"email": email},
+            {
+                "$set": {
+                    "email_verified": True,
+                    "email_verified_at": datetime.utcnow(),
+                }
+            },
+            projection={"_id": 0, "id": 1},
+        )
+        if user and self.auth_cache is not None:
+            await self.auth_cache.invalidate(user["id"])
+        return user is not None
 
     async def send_verification_email(self, user_email: str) -> dict:
         """Send email verification token and code"""
@@ -493,7 +512,7 @@ class EmailVerificationService:
             }
 
         except Exception as e:
-            logger.error(f"Error sending verification email: {str(e)}")
+            logger.error("Error sending verification email: %s", e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to send verification email",
@@ -538,22 +557,12 @@ class EmailVerificationService:
             )
 
             # Update user as verified
-            result = await self.db.users.update_one(
-                {"email": email},
-                {
-                    "$set": {
-                        "email_verified": True,
-                        "email_verified_at": datetime.utcnow(),
-                    }
-                },
-            )
-
-            if result.modified_count > 0:
+            if await self._mark_email_verified(email):
                 # Send welcome email
                 try:
                     await self.email_service.send_welcome_email(email)
                 except Exception as e:
-                    logger.warning(f"Failed to send welcome email: {str(e)}")
+                    logger.warning("Failed to send welcome email: %s", e)
 
             return {
                 "message": "Email verified successfully",
@@ -563,7 +572,7 @@ class EmailVerificationService:
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"Error verifying email: {str(e)}")
+            logger.error("Error verifying email: %s", e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Email verification failed",
@@ -590,20 +599,12 @@ class EmailVerificationService:
                 {"$set": {"is_used": True, "verified_at": datetime.utcnow()}},
             )
 
-            await self.db.users.update_one(
-                {"email": verification["email"]},
-                {
-                    "$set": {
-                        "email_verified": True,
-                        "email_verified_at": datetime.utcnow(),
-                    }
-                },
-            )
+            await self._mark_email_verified(verification["email"])
 
             try:
                 await self.email_service.send_welcome_email(verification["email"])
             except Exception as e:
-                logger.warning(f"Failed to send welcome email: {str(e)}")
+                logger.warning("Failed to send welcome email: %s", e)
 
             return {
                 "message": "Email verified successfully",
@@ -612,7 +613,7 @@ class EmailVerificationService:
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"Error verifying email token: {str(e)}")
+            logger.error("Error verifying email token: %s", e)
             raise HTTPException(
                 status.HTTP_500_INTERNAL_SERVER_ERROR, "Email verification failed"
             )
@@ -1,8 +1,10 @@
 import os
 import io
 import uuid
+import asyncio
+from concurrent.futures import Executor
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
@@ -16,10 +18,16 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Size of the chunks streamed back for PDF downloads
+PDF_CHUNK_SIZE = 64 * 1024
+
 class DecisionPDFExporter:
     """Service for exporting decision sessions to PDF format"""
     
-    def __init__(self):
+    def __init__(self, executor: Optional[Executor] = None):
+        # Rendering runs here so it never blocks the event loop; None falls
+        # back to the loop's default thread pool
+        self.executor = executor
         self.styles = getSampleStyleSheet()
         self.setup_custom_styles()
     
@@ -89,6 +97,60 @@ class DecisionPDFExporter:
         include_metadata: bool = True
     ) -> bytes:
         """Export a decision session to PDF format"""
+        return await self._render_in_executor(decision_data, conversations, user_info, include_metadata)
+    
+    async def stream_decision_to_pdf(
+        self,
+        decision_data: Dict,
+        conversations: List[Dict],
+        user_info: Dict,
+        include_metadata: bool = True,
+        chunk_size: int = PDF_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        """Render a decision session to PDF and return an iterator over its chunks
+        
+        Rendering happens before this returns so errors surface to the caller;
+        the chunks are sliced from the rendered document without copying it.
+        """
+        pdf_data = await self._render_in_executor(decision_data, conversations, user_info, include_metadata)
+        return self._iter_chunks(pdf_data, chunk_size)
+    
+    async def _render_in_executor(
+        self,
+        decision_data: Dict,
+        conversations: List[Dict],
+        user_info: Dict,
+        include_metadata: bool
+    ) -> bytes:
+        """Render the PDF on the configured executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            render_decision_pdf,
+            decision_data,
+            conversations,
+            user_info,
+            include_metadata
+        )
+    
+    @staticmethod
+    def _iter_chunks(data: bytes, chunk_size: int) -> Iterator[bytes]:
+        """Yield the document in chunks"""
+        view = memoryview(data)
+        try:
+            for start in range(0, len(view), chunk_size):
+                yield bytes(view[start:start + chunk_size])
+        finally:
+            view.release()
+    
+    def _render_pdf(
+        self,
+        decision_data: Dict,
+        conversations: List[Dict],
+        user_info: Dict,
+        include_metadata: bool = True
+    ) -> io.BytesIO:
+        """Build the PDF document into an in-memory buffer"""
         try:
             # Create PDF buffer
             buffer = io.BytesIO()
@@ -122,14 +184,10 @@ class DecisionPDFExporter:
             # Build PDF
             doc.build(story)
             
-            # Get PDF bytes
-            pdf_data = buffer.getvalue()
-            buffer.close()
-            
-            return pdf_data
+            return buffer
             
         except Exception as e:
-            logger.error(f"Error generating PDF: {str(e)}")
+            logger.error("Error generating PDF: %s", e)
             raise
     
     def _build_header(self, decision_data: Dict, user_info: Dict) -> List:
@@ -285,6 +343,32 @@ class DecisionPDFExporter:
         
         return story
 
+_worker_exporter: Optional[DecisionPDFExporter] = None
+
+def render_decision_pdf(
+    decision_data: Dict,
+    conversations: List[Dict],
+    user_info: Dict,
+    include_metadata: bool = True
+) -> bytes:
+    """Render a decision session to PDF bytes
+    
+    Module-level so it can be pickled into a worker process; each worker
+    builds its own exporter (and stylesheet) once and reuses it.
+    """
+    global _worker_exporter
+    if _worker_exporter is None:
+        _worker_exporter = DecisionPDFExporter()
+    buffer = _worker_exporter._render_pdf(decision_data, conversations, user_info, include_metadata)
+    try:
+        return buffer.getvalue()
+    finally:
+        buffer.close()
+
+def _as_datetime(value) -> datetime:
+    """Session dates are datetimes, or ISO strings in older documents"""
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
 class DecisionSharingService:
     """Service for creating shareable decision links"""
     
@@ -330,7 +414,7 @@ class DecisionSharingService:
             }
             
         except Exception as e:
-            logger.error(f"Error creating shareable link: {str(e)}")
+            logger.error("Error creating shareable link: %s", e)
             raise
     
     async def get_shared_decision(self, share_id: str) -> Optional[Dict]:
@@ -399,7 +483,7 @@ class DecisionSharingService:
             }
             
         except Exception as e:
-            logger.error(f"Error getting shared decision: {str(e)}")
+            logger.error("Error getting shared decision: %s", e)
             return None
     
     async def revoke_share(self, share_id: str, user_id: str) -> bool:
@@ -411,7 +495,7 @@ class DecisionSharingService:
             )
             return result.modified_count > 0
         except Exception as e:
-            logger.error(f"Error revoking share: {str(e)}")
+            logger.error("Error revoking share: %s", e)
             return False
 
 class DecisionComparisonService:
@@ -429,21 +513,32 @@ class DecisionComparisonService:
         try:
             comparisons = []
             
+            # Fetch the sessions and their conversation summaries together
+            decisions, grouped = await asyncio.gather(
+                self.db.decision_sessions.find(
+                    {"decision_id": {"$in": decision_ids}, "user_id": user_id},
+                    {
+                        "_id": 0,
+                        "decision_id": 1,
+                        "title": 1,
+                        "category": 1,
+                        "advisor_style": 1,
+                        "created_at": 1,
+                        "last_active": 1
+                    }
+                ).to_list(len(decision_ids)),
+                self._conversation_summaries(decision_ids, user_id)
+            )
+            decisions_by_id = {d["decision_id"]: d for d in decisions}
+            conversations_by_id = {g["_id"]: g["msgs"] for g in grouped}
+            
             for decision_id in decision_ids:
-                # Get decision data
-                decision = await self.db.decision_sessions.find_one({
-                    "decision_id": decision_id,
-                    "user_id": user_id
-                })
+                decision = decisions_by_id.get(decision_id)
                 
                 if not decision:
                     continue
                 
-                # Get conversation summary
-                conversations = await self.db.conversations.find({
-                    "decision_id": decision_id,
-                    "user_id": user_id
-                }).to_list(100)
+                conversations = conversations_by_id.get(decision_id, [])
                 
                 # Calculate metrics
                 total_messages = len(conversations)
@@ -469,8 +564,8 @@ class DecisionComparisonService:
                         "total_credits": total_credits,
                         "ai_models_used": ai_models_used,
                         "duration_days": (
-                            datetime.fromisoformat(decision.get("last_active", "")).date() - 
-                            datetime.fromisoformat(decision.get("created_at", "")).date()
+                            _as_datetime(decision["last_active"]).date() -
+                            _as_datetime(decision["created_at"]).date()
                         ).days if decision.get("created_at") and decision.get("last_active") else 0
                     },
                     "final_recommendation": final_recommendation
@@ -489,9 +584,27 @@ class DecisionComparisonService:
             }
             
         except Exception as e:
-            logger.error(f"Error comparing decisions: {str(e)}")
+            logger.error("Error comparing decisions: %s", e)
             raise
-    
+
+    async def _conversation_summaries(self, decision_ids: List[str], user_id: str) -> List[Dict]:
+        """Group conversation summaries per decision in one aggregation"""
+        cursor = await self.db.conversations.aggregate([
+            {"$match": {"decision_id": {"$in": decision_ids}, "user_id": user_id}},
+            {"$sort": {"timestamp": 1}},
+            {"$group": {
+                "_id": "$decision_id",
+                "msgs": {"$push": {
+                    "advisor_style": "$advisor_style",
+                    "credits_used": "$credits_used",
+                    "llm_used": "$llm_used",
+                    "ai_response": "$ai_response"
+                }}
+            }},
+            {"$project": {"msgs": {"$slice": ["$msgs", 100]}}}
+        ])
+        return await cursor.to_list(len(decision_ids))
+
     def _generate_comparison_insights(self, comparisons: List[Dict]) -> Dict:
         """Generate insights from decision comparisons"""
         if not comparisons:
@@ -1,24 +1,115 @@
 import os
 import logging
-import json
+import orjson
 import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 from fastapi import HTTPException, status
 import asyncio
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict, deque
 import hashlib
+from pymongo import InsertOne
 
 logger = logging.getLogger(__name__)
 
+class BatchedWriter:
+    """Buffers fire-and-forget writes and flushes them with bulk_write
+    
+    Until start() is called (or when the buffer is full) writes go straight
+    to the database, so callers never have to know whether batching is on.
+    """
+    
+    def __init__(self, db, flush_interval: float = 0.05, max_batch: int = 200, max_pending: int = 10000):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self._task = None
+    
+    def start(self):
+        """Start the background flush task"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Flush everything still queued and stop the background task"""
+        if self._task is None:
+            return
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+    
+    async def write(self, collection: str, operation):
+        """Queue a pymongo write operation (InsertOne, UpdateOne, ...)"""
+        if self._task is not None:
+            try:
+                self.queue.put_nowait((collection, operation))
+                return
+            except asyncio.QueueFull:
+                pass
+        await self.db[collection].bulk_write([operation])
+    
+    async def _run(self):
+        """Drain the queue every flush_interval seconds or max_batch operations"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            
+            batch = defaultdict(list)
+            batch[item[0]].append(item[1])
+            count = 1
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while count < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch[item[0]].append(item[1])
+                count += 1
+            
+            await self._flush(batch)
+            if stopping:
+                return
+    
+    async def _flush(self, batch: Dict[str, List]):
+        """Write one unordered bulk per collection"""
+        for collection, operations in batch.items():
+            try:
+                await self.db[collection].bulk_write(operations, ordered=False)
+            except Exception as e:
+                logger.error("Error flushing %s writes to %s: %s", len(operations), collection, e)
+
+# Fixed-window counter: one round trip, and the window starts on the first hit
+RATE_LIMIT_SCRIPT = """
+local count = redis.call("INCR", KEYS[1])
+if count == 1 then redis.call("EXPIRE", KEYS[1], ARGV[1]) end
+return count
+"""
+
 class SecurityMonitor:
     """Enhanced security monitoring and alerting system"""
     
-    def __init__(self, db, email_service):
+    def __init__(self, db, email_service, writer: Optional[BatchedWriter] = None, redis=None):
         self.db = db
         self.email_service = email_service
+        self.writer = writer or BatchedWriter(db)
+        # Shared counters across workers when Redis is available
+        self.redis = redis
+        self._rate_limit_script = redis.register_script(RATE_LIMIT_SCRIPT) if redis is not None else None
         self.failed_attempts = defaultdict(deque)  # IP -> deque of timestamps
-        self.rate_limits = defaultdict(deque)      # key -> deque of timestamps
+        # key -> deque of timestamps, least recently hit first; keys come from
+        # request data, so the map is bounded and empty keys are dropped
+        self.rate_limits = OrderedDict()
+        self.MAX_RATE_LIMIT_KEYS = 100000
         self.suspicious_ips = set()
         self.blocked_ips = set()
         
@@ -37,40 +128,76 @@ class SecurityMonitor:
         }
     
     async def check_rate_limit(self, request_type: str, identifier: str) -> bool:
-        """Check if request is within rate limits"""
+        """Check if request is within rate limits, counting it as an attempt"""
+        if not await self.is_within_rate_limit(request_type, identifier):
+            return False
+        await self.record_attempt(request_type, identifier)
+        return True
+    
+    async def is_within_rate_limit(self, request_type: str, identifier: str) -> bool:
+        """Check the rate limit without counting this request"""
         try:
-            now = time.time()
             key = f"{request_type}:{identifier}"
-            
-            # Get rate limit config
             config = self.RATE_LIMITS.get(request_type, self.RATE_LIMITS["general"])
             limit = config["limit"]
             window = config["window"]
             
-            # Clean old requests
-            while self.rate_limits[key] and now - self.rate_limits[key][0] > window:
-                self.rate_limits[key].popleft()
+            if self.redis is not None:
+                attempts = int(await self.redis.get(f"rl:{key}") or 0)
+            else:
+                recent = self._recent_attempts(key, window, time.time())
+                attempts = len(recent) if recent else 0
             
-            # Check limit
-            if len(self.rate_limits[key]) >= limit:
+            if attempts >= limit:
                 await self.log_security_event({
                     "event_type": "rate_limit_exceeded",
                     "request_type": request_type,
                     "identifier": identifier,
-                    "attempts": len(self.rate_limits[key]),
+                    "attempts": attempts,
                     "limit": limit,
                     "window": window
                 })
                 return False
-            
-            # Add current request
-            self.rate_limits[key].append(now)
             return True
             
         except Exception as e:
-            logger.error(f"Error checking rate limit: {str(e)}")
+            logger.error("Error checking rate limit: %s", e)
             return True  # Fail open for availability
     
+    async def record_attempt(self, request_type: str, identifier: str):
+        """Count one attempt against a rate limit"""
+        try:
+            key = f"{request_type}:{identifier}"
+            config = self.RATE_LIMITS.get(request_type, self.RATE_LIMITS["general"])
+            
+            if self._rate_limit_script is not None:
+                await self._rate_limit_script(keys=[f"rl:{key}"], args=[config["window"]])
+                return
+            
+            now = time.time()
+            attempts = self._recent_attempts(key, config["window"], now)
+            if attempts is None:
+                attempts = self.rate_limits[key] = deque()
+            attempts.append(now)
+            self.rate_limits.move_to_end(key)
+            while len(self.rate_limits) > self.MAX_RATE_LIMIT_KEYS:
+                self.rate_limits.popitem(last=False)
+            
+        except Exception as e:
+            logger.error("Error recording rate limit attempt: %s", e)
+    
+    def _recent_attempts(self, key: str, window: int, now: float) -> Optional[deque]:
+        """A key's attempts inside the window, dropping the key once none remain"""
+        attempts = self.rate_limits.get(key)
+        if attempts is None:
+            return None
+        while attempts and now - attempts[0] > window:
+            attempts.popleft()
+        if not attempts:
+            del self.rate_limits[key]
+            return None
+        return attempts
+    
     async def check_ip_reputation(self, ip_address: str) -> bool:
         """Check if IP is blocked or suspicious"""
         if ip_address in self.blocked_ips:
@@ -137,7 +264,7 @@ class SecurityMonitor:
             return True
             
         except Exception as e:
-            logger.error(f"Error tracking failed login: {str(e)}")
+            logger.error("Error tracking failed login: %s", e)
             return True
     
     async def _schedule_unban(self, ip_address: str):
@@ -181,7 +308,7 @@ class SecurityMonitor:
                 await self.flag_user_for_review(user_id, suspicious_indicators)
             
         except Exception as e:
-            logger.error(f"Error detecting suspicious patterns: {str(e)}")
+            logger.error("Error detecting suspicious patterns: %s", e)
     
     async def flag_user_for_review(self, user_id: str, indicators: List[str]):
         """Flag user account for manual review"""
@@ -203,7 +330,7 @@ class SecurityMonitor:
             )
             
         except Exception as e:
-            logger.error(f"Error flagging user: {str(e)}")
+            logger.error("Error flagging user: %s", e)
     
     async def log_security_event(self, event_data: Dict):
         """Log security events for audit and analysis"""
@@ -214,13 +341,13 @@ class SecurityMonitor:
             })
             
             # Store in database
-            await self.db.security_events.insert_one(event_data)
+            await self.writer.write("security_events", InsertOne(event_data))
             
             # Log to file
-            logger.warning(f"SECURITY_EVENT: {json.dumps(event_data, default=str)}")
+            logger.warning("SECURITY_EVENT: %s", orjson.dumps(event_data, default=str).decode())
             
         except Exception as e:
-            logger.error(f"Error logging security event: {str(e)}")
+            logger.error("Error logging security event: %s", e)
     
     async def _send_security_alert(self, alert_type: str, details: str):
         """Send security alert email"""
@@ -232,7 +359,7 @@ class SecurityMonitor:
                     email, alert_type, details
                 )
         except Exception as e:
-            logger.error(f"Error sending security alert: {str(e)}")
+            logger.error("Error sending security alert: %s", e)
     
     async def _send_admin_alert(self, subject: str, message: str):
         """Send admin alert"""
@@ -241,8 +368,9 @@ class SecurityMonitor:
 class SystemMonitor:
     """System performance and health monitoring"""
     
-    def __init__(self, db):
+    def __init__(self, db, writer: Optional[BatchedWriter] = None):
         self.db = db
+        self.writer = writer or BatchedWriter(db)
         self.metrics = defaultdict(list)
         self.alerts = []
         
@@ -265,14 +393,14 @@ class SystemMonitor:
             }
             
             # Store in database (with TTL in production)
-            await self.db.performance_metrics.insert_one(metric)
+            await self.writer.write("performance_metrics", InsertOne(metric))
             
             # Check for performance issues
             if response_time > self.RESPONSE_TIME_THRESHOLD:
                 await self._alert_slow_response(endpoint, response_time)
             
         except Exception as e:
-            logger.error(f"Error tracking performance: {str(e)}")
+            logger.error("Error tracking performance: %s", e)
     
     async def calculate_error_rate(self, endpoint: str, window_minutes: int = 60) -> float:
         """Calculate error rate for endpoint in time window"""
@@ -304,7 +432,7 @@ class SystemMonitor:
             return error_rate
             
         except Exception as e:
-            logger.error(f"Error calculating error rate: {str(e)}")
+            logger.error("Error calculating error rate: %s", e)
             return 0.0
     
     async def check_system_health(self) -> Dict:
@@ -342,7 +470,7 @@ class SystemMonitor:
             return health_data
             
         except Exception as e:
-            logger.error(f"Error checking system health: {str(e)}")
+            logger.error("Error checking system health: %s", e)
             return {"overall_status": "error", "error": str(e)}
     
     async def _get_avg_response_time(self, minutes: int = 15) -> float:
@@ -355,7 +483,8 @@ class SystemMonitor:
                 {"$group": {"_id": None, "avg_time": {"$avg": "$response_time"}}}
             ]
             
-            result = await self.db.performance_metrics.aggregate(pipeline).to_list(1)
+            cursor = await self.db.performance_metrics.aggregate(pipeline)
+            result = await cursor.to_list(1)
             
             if result:
                 return round(result[0]["avg_time"], 3)
@@ -366,11 +495,11 @@ class SystemMonitor:
     
     async def _alert_slow_response(self, endpoint: str, response_time: float):
         """Alert for slow response times"""
-        logger.warning(f"SLOW_RESPONSE: {endpoint} took {response_time:.2f}s")
+        logger.warning("SLOW_RESPONSE: %s took %.2fs", endpoint, response_time)
     
     async def _alert_high_error_rate(self, endpoint: str, error_rate: float):
         """Alert for high error rates"""
-        logger.warning(f"HIGH_ERROR_RATE: {endpoint} has {error_rate:.2%} error rate")
+        logger.warning("HIGH_ERROR_RATE: %s has %.2f%% error rate", endpoint, error_rate * 100)
 
 class BackupManager:
     """Database backup and recovery management"""
@@ -424,8 +553,9 @@ class BackupManager:
 class AuditLogger:
     """Comprehensive audit logging for compliance"""
     
-    def __init__(self, db):
+    def __init__(self, db, writer: Optional[BatchedWriter] = None):
         self.db = db
+        self.writer = writer or BatchedWriter(db)
     
     async def log_user_action(self, user_id: str, action: str, details: Dict):
         """Log user actions for audit trail"""
@@ -439,10 +569,10 @@ class AuditLogger:
                 "user_agent": details.get("user_agent")
             }
             
-            await self.db.audit_logs.insert_one(audit_entry)
+            await self.writer.write("audit_logs", InsertOne(audit_entry))
             
         except Exception as e:
-            logger.error(f"Error logging user action: {str(e)}")
+            logger.error("Error logging user action: %s", e)
     
     async def log_admin_action(self, admin_id: str, action: str, target: str, details: Dict):
         """Log admin actions for accountability"""
@@ -456,27 +586,29 @@ class AuditLogger:
                 "severity": "high"
             }
             
-            await self.db.admin_audit_logs.insert_one(audit_entry)
+            await self.writer.write("admin_audit_logs", InsertOne(audit_entry))
             
         except Exception as e:
-            logger.error(f"Error logging admin action: {str(e)}")
+            logger.error("Error logging admin action: %s", e)
     
     async def generate_audit_report(self, start_date: datetime, end_date: datetime) -> Dict:
         """Generate comprehensive audit report"""
         try:
             # User action summary
-            user_actions = await self.db.audit_logs.aggregate([
+            cursor = await self.db.audit_logs.aggregate([
                 {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date}}},
                 {"$group": {"_id": "$action", "count": {"$sum": 1}}},
                 {"$sort": {"count": -1}}
-            ]).to_list(50)
+            ])
+            user_actions = await cursor.to_list(50)
             
             # Security events summary
-            security_events = await self.db.security_events.aggregate([
+            cursor = await self.db.security_events.aggregate([
                 {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date}}},
                 {"$group": {"_id": "$event_type", "count": {"$sum": 1}}},
                 {"$sort": {"count": -1}}
-            ]).to_list(50)
+            ])
+            security_events = await cursor.to_list(50)
             
             return {
                 "period": {"start": start_date, "end": end_date},
@@ -486,5 +618,5 @@ class AuditLogger:
             }
             
         except Exception as e:
-            logger.error(f"Error generating audit report: {str(e)}")
+            logger.error("Error generating audit report: %s", e)
             return {"error": str(e)}
\ No newline at end of file
@@ -6,7 +6,6 @@ import hashlib
 import logging
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
-from motor.motor_asyncio import AsyncIOMotorClient
 from payment_models import (
     PaymentRequest, SubscriptionRequest, PaymentDocument, SubscriptionDocument,
     CREDIT_PACKS, SUBSCRIPTION_PRODUCTS, PaymentResponse, SubscriptionResponse,
@@ -87,7 +86,7 @@ class DodoPaymentsService:
             )
             
         except Exception as e:
-            logger.error(f"Error creating payment link: {str(e)}")
+            logger.error("Error creating payment link: %s", e)
             raise
     
     async def create_subscription(
@@ -157,10 +156,10 @@ class DodoPaymentsService:
             )
             
         except httpx.HTTPStatusError as e:
-            logger.error(f"Dodo API error: {e.response.status_code} - {e.response.text}")
+            logger.error("Dodo API error: %s - %s", e.response.status_code, e.response.text)
             raise
         except Exception as e:
-            logger.error(f"Error creating subscription: {str(e)}")
+            logger.error("Error creating subscription: %s", e)
             raise
     
     async def verify_webhook_signature(self, payload: bytes, signature: str, timestamp: str) -> bool:
@@ -184,10 +183,12 @@ class DodoPaymentsService:
             ).hexdigest()
             
             # Use constant-time comparison to prevent timing attacks
-            return hmac.compare_digest(expected_signature, signature)
+            return hmac.compare_digest(
+                expected_signature.encode('utf-8'), signature.encode('utf-8')
+            )
             
         except Exception as e:
-            logger.error(f"Error verifying webhook signature: {str(e)}")
+            logger.error("Error verifying webhook signature: %s", e)
             return False
     
     async def get_payment_status(self, dodo_payment_id: str) -> Dict[str, Any]:
@@ -201,7 +202,7 @@ class DodoPaymentsService:
                 response.raise_for_status()
                 return response.json()
         except Exception as e:
-            logger.error(f"Error getting payment status: {str(e)}")
+            logger.error("Error getting payment status: %s", e)
             raise
     
     async def cancel_subscription(self, dodo_subscription_id: str) -> bool:
@@ -215,5 +216,5 @@ class DodoPaymentsService:
                 response.raise_for_status()
                 return True
         except Exception as e:
-            logger.error(f"Error cancelling subscription: {str(e)}")
+            logger.error("Error cancelling subscription: %s", e)
             return False
\ No newline at end of file
@@ -26,22 +26,37 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         
         return response
 
+class FastPathCORSMiddleware(CORSMiddleware):
+    """CORSMiddleware that skips header parsing for requests without an Origin"""
+    
+    async def __call__(self, scope, receive, send):
+        # Non-CORS traffic (health checks, server-to-server webhooks) is
+        # detected from the raw ASGI headers without building a Headers object
+        if scope["type"] != "http" or not any(
+            name == b"origin" for name, _ in scope["headers"]
+        ):
+            await self.app(scope, receive, send)
+            return
+        
+        await super().__call__(scope, receive, send)
+
 class CORSSecurityMiddleware:
     """CORS middleware with security enhancements"""
     
     @staticmethod
-    def setup(app: FastAPI, allowed_origins=None):
+    def setup(app: FastAPI, allowed_origins=None, max_age: int = 86400):
         """Set up CORS with security enhancements"""
         if allowed_origins is None:
             allowed_origins = ["*"]
         
         app.add_middleware(
-            CORSMiddleware,
+            FastPathCORSMiddleware,
             allow_origins=allowed_origins,
             allow_credentials=True,
             allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
             allow_headers=["*"],
-            expose_headers=["Content-Disposition"]
+            expose_headers=["Content-Disposition"],
+            max_age=max_age
         )
         
         return app
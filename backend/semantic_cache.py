@@ -0,0 +1,118 @@
+import os
+import uuid
+import hashlib
+import logging
+from array import array
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_INDEX = "idx:semantic_chat"
+SEMANTIC_CACHE_PREFIX = "semcache:"
+SEMANTIC_CACHE_DIM = 1536  # text-embedding-3-small
+SEMANTIC_CACHE_TTL = int(os.environ.get("SEMANTIC_CACHE_TTL", str(7 * 24 * 60 * 60)))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.93"))
+
+
+def parse_style_thresholds(value: str) -> dict:
+    """Parse "style=0.95,other=0.9" into per-style similarity thresholds"""
+    thresholds = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        style, _, threshold = item.partition("=")
+        thresholds[style.strip()] = float(threshold)
+    return thresholds
+
+
+# Raw cosine similarity means different things per advisor voice, so each
+# style can be calibrated separately; unlisted styles use the default
+SEMANTIC_CACHE_STYLE_THRESHOLDS = parse_style_thresholds(
+    os.environ.get("SEMANTIC_CACHE_STYLE_THRESHOLDS", "")
+)
+
+
+class SemanticCache:
+    """Reuses AI responses for messages that mean the same thing
+
+    Entries live in a RediSearch HNSW vector index and are partitioned by a
+    hash of the system prompt, so a cached answer is only reused for the same
+    category, advisor style and user preferences.
+    """
+
+    def __init__(self, redis, embed: Callable[[str], Awaitable[List[float]]]):
+        self.redis = redis
+        self.embed = embed
+
+    @staticmethod
+    def partition(system_message: str) -> str:
+        return hashlib.sha256(system_message.encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def threshold(advisor_style: str) -> float:
+        return SEMANTIC_CACHE_STYLE_THRESHOLDS.get(advisor_style, SEMANTIC_CACHE_THRESHOLD)
+
+    async def ensure_index(self):
+        """Create the vector index unless it already exists"""
+        try:
+            await self.redis.execute_command(
+                "FT.CREATE", SEMANTIC_CACHE_INDEX,
+                "ON", "HASH", "PREFIX", "1", SEMANTIC_CACHE_PREFIX,
+                "SCHEMA",
+                "partition", "TAG",
+                "advisor_style", "TAG",
+                "vector", "VECTOR", "HNSW", "6",
+                "TYPE", "FLOAT32", "DIM", str(SEMANTIC_CACHE_DIM), "DISTANCE_METRIC", "COSINE",
+            )
+        except Exception as e:
+            if "already exists" not in str(e):
+                logger.warning("Semantic cache index creation failed: %s", e)
+
+    async def lookup(self, message: str, system_message: str, advisor_style: str) -> tuple[Optional[dict], Optional[bytes]]:
+        """Return (cached entry or None, message vector to store on a miss)"""
+        try:
+            vector = array("f", await self.embed(message)).tobytes()
+            reply = await self.redis.execute_command(
+                "FT.SEARCH", SEMANTIC_CACHE_INDEX,
+                f"(@partition:{{{self.partition(system_message)}}})=>[KNN 1 @vector $vec AS distance]",
+                "PARAMS", "2", "vec", vector,
+                "RETURN", "3", "response", "confidence", "distance",
+                "DIALECT", "2",
+            )
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed: %s", e)
+            return None, None
+
+        # RESP2 reply: [total, key, [field, value, ...], ...]
+        if len(reply) < 3:
+            return None, vector
+        fields = reply[2]
+        entry = {
+            (k.decode() if isinstance(k, bytes) else k): v
+            for k, v in zip(fields[::2], fields[1::2])
+        }
+        # COSINE distance is 1 - similarity
+        similarity = 1 - float(entry["distance"])
+        if similarity <= self.threshold(advisor_style):
+            return None, vector
+        return {
+            "response": entry["response"].decode("utf-8"),
+            "confidence": float(entry["confidence"]),
+            "similarity": similarity,
+        }, vector
+
+    async def store(self, vector: bytes, system_message: str, advisor_style: str, category: str, response: str, confidence: float):
+        """Cache a generated response under the message's vector"""
+        key = f"{SEMANTIC_CACHE_PREFIX}{uuid.uuid4().hex}"
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hset(key, mapping={
+                    "partition": self.partition(system_message),
+                    "advisor_style": advisor_style,
+                    "category": category,
+                    "vector": vector,
+                    "response": response,
+                    "confidence": confidence,
+                })
+                pipe.expire(key, SEMANTIC_CACHE_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Semantic cache write failed: %s", e)
@@ -1,9 +1,29 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request
+from fastapi import (
+    FastAPI,
+    APIRouter,
+    BackgroundTasks,
+    HTTPException,
+    Depends,
+    status,
+    Request,
+    Response,
+)
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import json
+import asyncio
+import functools
+import multiprocessing
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+import httpx
+import orjson
 from dotenv import load_dotenv
-from starlette.middleware.cors import CORSMiddleware
-from security_middleware import SecurityMiddleware, CORSSecurityMiddleware
+from security_middleware import (
+    SecurityMiddleware,
+    FastPathCORSMiddleware,
+)
 from account_management import (
     AccountSecurityService,
     EmailVerificationRequest,
@@ -12,28 +32,55 @@ from account_management import (
     DataExportRequest,
     PrivacySettings,
 )
-from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from pymongo import AsyncMongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Literal
+from typing import List, NamedTuple, Optional, Literal
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from emergentintegrations.llm.chat import LlmChat, UserMessage
+
+# Streaming needs the provider SDKs; without them /decision/stream falls back
+# to sending the buffered response as a single chunk
+try:
+    from anthropic import AsyncAnthropic
+except ImportError:
+    AsyncAnthropic = None
+try:
+    from openai import AsyncOpenAI
+except ImportError:
+    AsyncOpenAI = None
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 import re
 import time
 import jwt
 import hashlib
+import hmac
 import secrets
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import smtplib
 import sys
-import io
 
-# Add the backend directory to the path
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Add the backend directory to the path once (it is already there when
+# launched with --app-dir backend)
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+
+# Sibling modules do "from server import ..."; when this file is loaded as
+# backend.server, point that name at this module instead of importing it twice
+sys.modules.setdefault("server", sys.modules[__name__])
 
 from payment_models import (
     PaymentRequest,
@@ -54,7 +101,10 @@ from export_service import (
     DecisionComparisonService,
 )
 from email_service import EmailService, EmailVerificationService
+from auth_cache import AuthCache
+from semantic_cache import SemanticCache
 from monitoring_service import (
+    BatchedWriter,
     SecurityMonitor,
     SystemMonitor,
     BackupManager,
@@ -67,13 +117,85 @@ load_dotenv(ROOT_DIR / ".env")
 
 # MongoDB connection
 mongo_url = os.environ["MONGO_URL"]
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncMongoClient(
+    mongo_url,
+    maxPoolSize=int(os.environ.get("MONGO_MAX_POOL_SIZE", "50")),
+    minPoolSize=int(os.environ.get("MONGO_MIN_POOL_SIZE", "10")),
+    # Recycle connections idle for 5 minutes rather than keeping bursts' worth
+    maxIdleTimeMS=300_000,
+    # Conversation text compresses well; zlib is used when zstd is missing
+    compressors="zstd,zlib",
+)
 db = client[os.environ["DB_NAME"]]
 
+
+async def aggregate_to_list(collection, pipeline: list, length: Optional[int]):
+    """Run an aggregation and collect up to length results"""
+    cursor = await collection.aggregate(pipeline)
+    return await cursor.to_list(length)
+
+
+def orjson_default(obj):
+    """Encode Mongo and numeric types that orjson does not handle natively"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class APIJSONResponse(ORJSONResponse):
+    """orjson response that also understands ObjectId and Decimal values"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(
+            content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS
+        )
+
+
+# In production the OpenAPI schema (and the docs built on it) is never
+# generated; elsewhere it is built on the first docs request
+CHOICEPILOT_ENV = os.environ.get("CHOICEPILOT_ENV", "development")
+IS_PRODUCTION = CHOICEPILOT_ENV in ("prod", "production")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background services, then release them in reverse on shutdown"""
+    await configure_logging()
+    # Connect before serving so the first requests don't pay the handshake;
+    # minPoolSize then keeps the pool filled in the background. Only this
+    # ping fails fast; requests keep the driver's server selection timeout.
+    await asyncio.wait_for(db.command("ping"), timeout=2)
+    await create_indexes()
+    await migrate_user_dates()
+    if semantic_cache is not None:
+        await semantic_cache.ensure_index()
+    await start_event_writer()
+    await start_pdf_pool()
+    # Build the AI orchestrator and tokenizer off the event loop while
+    # requests are served
+    orchestrator_warmup = asyncio.create_task(asyncio.to_thread(get_ai_orchestrator))
+    tokenizer_warmup = asyncio.create_task(asyncio.to_thread(get_token_encoding))
+    try:
+        yield
+    finally:
+        orchestrator_warmup.cancel()
+        tokenizer_warmup.cancel()
+        await shutdown_pdf_pool()
+        await shutdown_event_writer()
+        await auth_cache.close()
+        await close_llm_clients()
+        await shutdown_db_client()
+
+
 # Create the main app without a prefix
 app = FastAPI(
     title="ChoicePilot API",
     description="AI-powered decision assistant with monetization",
+    openapi_url=None if IS_PRODUCTION else "/openapi.json",
+    default_response_class=APIJSONResponse,
+    lifespan=lifespan,
 )
 
 # Create a router with the /api prefix
@@ -87,6 +209,15 @@ DODO_API_KEY = os.environ.get("DODO_API_KEY")
 DODO_WEBHOOK_SECRET = os.environ.get("DODO_WEBHOOK_SECRET")
 FRONTEND_URL = os.environ.get("FRONTEND_URL")
 
+# Processed webhook deliveries are remembered for 30 days to reject replays
+WEBHOOK_EVENT_TTL_SECONDS = 30 * 24 * 60 * 60
+WEBHOOK_TOLERANCE_SECONDS = 300  # 5 minutes
+# Webhook processors running at once, so delivery bursts queue instead of
+# exhausting the Mongo pool
+WEBHOOK_CONCURRENCY = int(os.environ.get("WEBHOOK_CONCURRENCY", "50"))
+webhook_semaphore = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", os.cpu_count() or 1))
+
 # Security
 security = HTTPBearer()
 
@@ -96,16 +227,42 @@ pdf_exporter = DecisionPDFExporter()
 sharing_service = DecisionSharingService(db)
 comparison_service = DecisionComparisonService(db)
 email_service = EmailService()
-email_verification_service = EmailVerificationService(db, email_service)
+
+auth_cache = AuthCache(redis_url=os.environ.get("REDIS_URL"))
+email_verification_service = EmailVerificationService(
+    db, email_service, auth_cache=auth_cache
+)
 
 # Initialize monitoring and security services
-security_monitor = SecurityMonitor(db, email_service)
-system_monitor = SystemMonitor(db)
+event_writer = BatchedWriter(db)
+security_monitor = SecurityMonitor(
+    db, email_service, event_writer, redis=auth_cache.redis
+)
+system_monitor = SystemMonitor(db, event_writer)
 backup_manager = BackupManager(db)
-audit_logger = AuditLogger(db)
+audit_logger = AuditLogger(db, event_writer)
 
 
 # Basic security features
+# Prompt-injection and script patterns stripped from user input in one pass
+DANGEROUS_INPUT_RE = re.compile(
+    "|".join(
+        [
+            r"(?i:ignore\s+previous\s+instructions)",
+            r"(?i:system\s*:)",
+            r"(?i:assistant\s*:)",
+            r"(?i:you\s+are\s+now)",
+            r"<script[^>]*>.*?</script>",
+            r"javascript:",
+        ]
+    )
+)
+MAX_INPUT_LENGTH = 10000
+# Extra input scanned past the limit, so a pattern the cut would split is
+# still filtered while the scan stays bounded
+INPUT_FILTER_MARGIN = 1000
+
+
 class BasicSecurityService:
     @staticmethod
     def sanitize_input(text: str) -> str:
@@ -113,28 +270,22 @@ class BasicSecurityService:
         if not text:
             return text
 
-        # Remove dangerous patterns
-        dangerous_patterns = [
-            r"(?i)ignore\s+previous\s+instructions",
-            r"(?i)system\s*:",
-            r"(?i)assistant\s*:",
-            r"(?i)you\s+are\s+now",
-            r"<script[^>]*>.*?</script>",
-            r"javascript:",
-        ]
-
-        for pattern in dangerous_patterns:
-            text = re.sub(pattern, "[FILTERED]", text)
+        # Remove dangerous patterns before truncating, so the cut can't
+        # leave a partial pattern behind
+        truncated = len(text) > MAX_INPUT_LENGTH
+        text = DANGEROUS_INPUT_RE.sub(
+            "[FILTERED]", text[: MAX_INPUT_LENGTH + INPUT_FILTER_MARGIN]
+        )
 
         # Limit length
-        if len(text) > 10000:
-            text = text[:10000] + "... [TRUNCATED]"
+        if truncated:
+            text = text[:MAX_INPUT_LENGTH] + "... [TRUNCATED]"
 
         return text.strip()
 
 
 security_service = BasicSecurityService()
-account_security = AccountSecurityService(db)
+account_security = AccountSecurityService(db, auth_cache=auth_cache)
 
 # Subscription Plans
 SUBSCRIPTION_PLANS = {
@@ -513,6 +664,7 @@ class ConversationHistory(BaseModel):
     advisor_style: str
     advisor_personality: Optional[dict] = None
     credits_used: int = 0
+    token_count: Optional[int] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 
@@ -656,32 +808,73 @@ DECISION_CATEGORIES = {
 
 
 # Authentication and Authorization
+password_hasher = PasswordHasher()
+
+
 def hash_password(password: str) -> str:
-    """Hash password using SHA-256 with salt"""
-    salt = secrets.token_hex(16)
-    password_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-    return f"{salt}:{password_hash}"
+    """Hash password using Argon2id"""
+    return password_hasher.hash(password)
+
+
+def is_legacy_password_hash(stored_hash: str) -> bool:
+    """Whether a stored hash uses the old salt:sha256 format"""
+    return not stored_hash.startswith("$argon2")
 
 
 def verify_password(password: str, stored_hash: str) -> bool:
-    """Verify password against stored hash"""
+    """Verify password against an Argon2 or legacy salted SHA-256 hash"""
+    if is_legacy_password_hash(stored_hash):
+        try:
+            salt, hash_value = stored_hash.split(":")
+        except ValueError:
+            return False
+        return hmac.compare_digest(
+            hashlib.sha256((password + salt).encode()).hexdigest(), hash_value
+        )
+
     try:
-        salt, hash_value = stored_hash.split(":")
-        return hashlib.sha256((password + salt).encode()).hexdigest() == hash_value
-    except:
+        return password_hasher.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
         return False
 
 
-def create_access_token(user_id: str, email: str) -> str:
+def password_needs_rehash(stored_hash: str) -> bool:
+    """Whether a verified hash should be upgraded to current Argon2 parameters"""
+    if is_legacy_password_hash(stored_hash):
+        return True
+    return password_hasher.check_needs_rehash(stored_hash)
+
+
+def create_access_token(
+    user_id: str, email: str, now: Optional[datetime] = None
+) -> str:
     """Create JWT access token"""
     payload = {
         "user_id": user_id,
         "email": email,
-        "exp": datetime.utcnow() + timedelta(days=30),
+        "exp": (now or datetime.utcnow()) + timedelta(days=30),
     }
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
 
+# Fields request handlers never read from the authenticated user
+AUTH_USER_PROJECTION = {
+    "password_hash": 0,
+    "privacy_settings": 0,
+    "credited_payments": 0,
+}
+
+
+async def load_auth_user(user_id: str) -> Optional[dict]:
+    """Load the user for an authenticated request, via the auth cache"""
+    user = await auth_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one({"id": user_id}, AUTH_USER_PROJECTION)
+        if user:
+            await auth_cache.set(user_id, user)
+    return user
+
+
 async def get_current_user_optional(
     credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False)),
 ) -> Optional[dict]:
@@ -695,7 +888,7 @@ async def get_current_user_optional(
         if not user_id:
             return None
 
-        user = await db.users.find_one({"id": user_id})
+        user = await load_auth_user(user_id)
         if not user or not user.get("is_active"):
             return None
 
@@ -716,7 +909,7 @@ async def get_current_user(
         if not user_id:
             raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Invalid token")
 
-        user = await db.users.find_one({"id": user_id})
+        user = await load_auth_user(user_id)
         if not user or not user.get("is_active"):
             raise HTTPException(
                 status.HTTP_401_UNAUTHORIZED, "User not found or inactive"
@@ -729,6 +922,57 @@ async def get_current_user(
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Invalid token")
 
 
+_LAST_RESET_DATE = {"$ifNull": ["$last_reset", "$$NOW"]}
+_SUBSCRIPTION_EXPIRES_DATE = {"$ifNull": ["$subscription_expires", "$$NOW"]}
+_IS_NEW_MONTH = {
+    "$or": [
+        {"$ne": [{"$month": _LAST_RESET_DATE}, {"$month": "$$NOW"}]},
+        {"$ne": [{"$year": _LAST_RESET_DATE}, {"$year": "$$NOW"}]},
+    ]
+}
+
+# Monthly counter reset and Pro expiry downgrade, applied in one update
+USAGE_ROLLOVER_PIPELINE = [
+    {
+        "$set": {
+            "monthly_decisions_used": {
+                "$cond": [_IS_NEW_MONTH, 0, "$monthly_decisions_used"]
+            },
+            "last_reset": {"$cond": [_IS_NEW_MONTH, "$$NOW", "$last_reset"]},
+            "plan": {
+                "$cond": [
+                    {
+                        "$and": [
+                            {"$eq": ["$plan", "pro"]},
+                            {"$lt": [_SUBSCRIPTION_EXPIRES_DATE, "$$NOW"]},
+                        ]
+                    },
+                    "free",
+                    "$plan",
+                ]
+            },
+        }
+    }
+]
+
+
+# Permission inputs resolved once instead of on every decision request
+_DECISION_CREDIT_COSTS = {
+    False: CREDIT_COSTS["text_decision"],
+    True: CREDIT_COSTS["voice_decision"],
+}
+_PRO_ONLY_ADVISORS = frozenset(
+    name for name, style in ADVISOR_STYLES.items() if style.get("pro_only", False)
+)
+# The "claude" preference is served by Sonnet
+_CLAUDE_PRO_ONLY = LLM_MODELS["claude-sonnet"]["pro_only"]
+# Auto-routing for Pro users by category; anything else goes to GPT-4o
+_PRO_AUTO_ROUTES = {
+    category: "claude" for category in LLM_MODELS["claude-sonnet"]["best_for"]
+}
+_FREE_MONTHLY_LIMIT = SUBSCRIPTION_PLANS["free"]["monthly_decisions"]
+
+
 async def check_usage_and_permissions(
     user: dict,
     use_voice: bool = False,
@@ -740,71 +984,51 @@ async def check_usage_and_permissions(
 
     # Reset monthly counter if it's a new month
     last_reset = user.get("last_reset", now)
-    if isinstance(last_reset, str):
-        last_reset = datetime.fromisoformat(last_reset.replace("Z", "+00:00"))
+    needs_reset = last_reset.month != now.month or last_reset.year != now.year
 
-    if last_reset.month != now.month or last_reset.year != now.year:
-        await db.users.update_one(
+    # Check subscription expiry for pro users
+    subscription_expires = user.get("subscription_expires")
+    needs_downgrade = (
+        user.get("plan", "free") == "pro"
+        and subscription_expires
+        and subscription_expires < now
+    )
+
+    if needs_reset or needs_downgrade:
+        # Re-check both conditions on the server so a concurrent request
+        # can't reset or downgrade against a stale copy of the user
+        updated = await db.users.find_one_and_update(
             {"id": user["id"]},
-            {"$set": {"monthly_decisions_used": 0, "last_reset": now}},
+            USAGE_ROLLOVER_PIPELINE,
+            projection=AUTH_USER_PROJECTION,
+            return_document=ReturnDocument.AFTER,
         )
-        user["monthly_decisions_used"] = 0
+        await auth_cache.invalidate(user["id"])
+        if updated:
+            user.update(updated)
 
     plan = user.get("plan", "free")
     monthly_used = user.get("monthly_decisions_used", 0)
     credits = user.get("credits", 0)
 
-    # Check subscription expiry for pro users
-    if plan == "pro":
-        subscription_expires = user.get("subscription_expires")
-        if subscription_expires and isinstance(subscription_expires, str):
-            subscription_expires = datetime.fromisoformat(
-                subscription_expires.replace("Z", "+00:00")
-            )
-
-        if subscription_expires and subscription_expires < now:
-            # Downgrade to free plan
-            await db.users.update_one({"id": user["id"]}, {"$set": {"plan": "free"}})
-            plan = "free"
-
-    # Calculate credit cost
-    if use_voice:
-        credit_cost = CREDIT_COSTS["voice_decision"]
-    else:
-        credit_cost = CREDIT_COSTS["text_decision"]
-
-    # Check permissions
+    credit_cost = _DECISION_CREDIT_COSTS[use_voice]
     errors = []
 
-    # Check advisor permissions
-    if ADVISOR_STYLES.get(advisor_style, {}).get("pro_only", False) and plan != "pro":
-        errors.append(f"Advisor '{advisor_style}' requires Pro subscription")
+    if plan != "pro":
+        if advisor_style in _PRO_ONLY_ADVISORS:
+            errors.append(f"Advisor '{advisor_style}' requires Pro subscription")
 
-    # Check LLM permissions
-    if (
-        llm_preference == "claude"
-        and LLM_MODELS["claude"]["pro_only"]
-        and plan != "pro"
-    ):
-        errors.append("Claude AI requires Pro subscription")
-
-    # Check decision limits
-    if plan == "free":
-        monthly_limit = SUBSCRIPTION_PLANS["free"]["monthly_decisions"]
-        if monthly_used >= monthly_limit and credits < credit_cost:
-            errors.append(
-                f"Monthly limit reached ({monthly_limit} decisions). Upgrade to Pro or buy credits."
-            )
+        if llm_preference == "claude" and _CLAUDE_PRO_ONLY:
+            errors.append("Claude AI requires Pro subscription")
 
-    # Check credit balance
-    if (
-        plan == "free"
-        and monthly_used >= SUBSCRIPTION_PLANS["free"]["monthly_decisions"]
-    ):
-        if credits < credit_cost:
-            errors.append(
-                f"Insufficient credits. Need {credit_cost} credits for this action."
-            )
+    # Free users past their monthly allowance pay for decisions with credits
+    if plan == "free" and monthly_used >= _FREE_MONTHLY_LIMIT and credits < credit_cost:
+        errors.append(
+            f"Monthly limit reached ({_FREE_MONTHLY_LIMIT} decisions). Upgrade to Pro or buy credits."
+        )
+        errors.append(
+            f"Insufficient credits. Need {credit_cost} credits for this action."
+        )
 
     if errors:
         return {"allowed": False, "errors": errors, "credit_cost": credit_cost}
@@ -812,10 +1036,31 @@ async def check_usage_and_permissions(
     return {"allowed": True, "errors": [], "credit_cost": credit_cost}
 
 
+async def enforce_auth_rate_limit(request: Request, email: str):
+    """Reject auth attempts over the per-IP or per-email limit before any lookup
+
+    Behind nginx, request.client is the real client address only because
+    uvicorn runs with --proxy-headers trusting the local proxy. Every attempt
+    counts against the IP, but only failed logins count against the email,
+    so nobody can lock a victim out just by knowing their address.
+    """
+    ip_address = request.client.host if request.client else "unknown"
+    if not await security_monitor.check_rate_limit(
+        "auth", f"ip:{ip_address}"
+    ) or not await security_monitor.is_within_rate_limit(
+        "auth", f"email:{email.lower()}"
+    ):
+        raise HTTPException(
+            status.HTTP_429_TOO_MANY_REQUESTS,
+            "Too many attempts. Please try again later.",
+        )
+
+
 # Enhanced authentication endpoints with security
 @api_router.post("/auth/register")
-async def register_user(user_data: UserRegistration):
+async def register_user(user_data: UserRegistration, request: Request):
     """Register a new user with enhanced security"""
+    await enforce_auth_rate_limit(request, user_data.email)
     try:
         # Enhanced input validation
 
@@ -874,13 +1119,16 @@ async def register_user(user_data: UserRegistration):
                 "Password must contain at least one special character",
             )
 
-        # Check if user already exists
-        existing_user = await db.users.find_one({"email": user_data.email})
+        # Check if user already exists while the password hashes in a thread
+        existing_user, password_hash = await asyncio.gather(
+            db.users.find_one({"email": user_data.email}, {"_id": 1}),
+            asyncio.to_thread(hash_password, user_data.password),
+        )
         if existing_user:
             raise HTTPException(status.HTTP_400_BAD_REQUEST, "Email already registered")
 
         # Create new user
-        password_hash = hash_password(user_data.password)
+        now = datetime.utcnow()
         user = User(
             name=user_data.name.strip(),
             email=user_data.email,
@@ -888,17 +1136,20 @@ async def register_user(user_data: UserRegistration):
             plan="free",
             credits=0,
             monthly_decisions_used=0,
+            created_at=now,
+            updated_at=now,
+            last_reset=now,
         )
 
-        await db.users.insert_one(user.dict())
+        await db.users.insert_one(user.model_dump())
 
         try:
             await email_verification_service.send_verification_email(user.email)
         except Exception as e:
-            logger.warning(f"Failed to send verification email: {str(e)}")
+            logger.warning("Failed to send verification email: %s", e)
 
         # Create access token
-        token = create_access_token(user.id, user.email)
+        token = create_access_token(user.id, user.email, now)
 
         return {
             "message": "User registered successfully.",
@@ -915,7 +1166,7 @@ async def register_user(user_data: UserRegistration):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Registration error: {str(e)}")
+        logger.error("Registration error: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Registration failed"
         )
@@ -937,7 +1188,7 @@ async def verify_email(request: dict):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Email verification error: {str(e)}")
+        logger.error("Email verification error: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Email verification failed"
         )
@@ -956,7 +1207,7 @@ async def resend_verification(request: dict):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Resend verification error: {str(e)}")
+        logger.error("Resend verification error: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to resend verification"
         )
@@ -969,13 +1220,20 @@ async def confirm_email(token: str):
 
 
 @api_router.post("/auth/login")
-async def login_user(login_data: UserLogin):
+async def login_user(login_data: UserLogin, request: Request):
     """Enhanced login with security checks"""
+    await enforce_auth_rate_limit(request, login_data.email)
     try:
         user = await db.users.find_one({"email": login_data.email})
-        if not user or not verify_password(login_data.password, user["password_hash"]):
+        # Hashing is deliberately slow, so keep it off the event loop
+        if not user or not await asyncio.to_thread(
+            verify_password, login_data.password, user["password_hash"]
+        ):
             # Log failed login attempt
-            logger.warning(f"Failed login attempt for email: {login_data.email}")
+            logger.warning("Failed login attempt for email: %s", login_data.email)
+            await security_monitor.record_attempt(
+                "auth", f"email:{login_data.email.lower()}"
+            )
             raise HTTPException(
                 status.HTTP_401_UNAUTHORIZED, "Invalid email or password"
             )
@@ -983,12 +1241,23 @@ async def login_user(login_data: UserLogin):
         if not user.get("is_active", True):
             raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Account is inactive")
 
-        # Update last login
-        await db.users.update_one(
-            {"id": user["id"]}, {"$set": {"last_login": datetime.utcnow()}}
+        # Upgrade legacy or outdated password hashes, unless the password
+        # was changed since this login read it
+        if password_needs_rehash(user["password_hash"]):
+            new_hash = await asyncio.to_thread(hash_password, login_data.password)
+            await db.users.update_one(
+                {"id": user["id"], "password_hash": user["password_hash"]},
+                {"$set": {"password_hash": new_hash}},
+            )
+
+        # Queued rather than awaited: a lost write only loses a last_login
+        now = datetime.utcnow()
+        await event_writer.write(
+            "users", UpdateOne({"id": user["id"]}, {"$set": {"last_login": now}})
         )
+        await auth_cache.invalidate(user["id"])
 
-        token = create_access_token(user["id"], user["email"])
+        token = create_access_token(user["id"], user["email"], now)
 
         return {
             "message": "Login successful",
@@ -1004,7 +1273,7 @@ async def login_user(login_data: UserLogin):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Login error: {str(e)}")
+        logger.error("Login error: %s", e)
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Login failed")
 
 
@@ -1019,26 +1288,26 @@ async def request_password_reset(request: PasswordResetRequest):
 
         # Generate reset token
         reset_token = secrets.token_urlsafe(32)
+        now = datetime.utcnow()
         reset_doc = {
             "email": request.email,
             "reset_token": reset_token,
-            "created_at": datetime.utcnow(),
-            "expires_at": datetime.utcnow() + timedelta(hours=1),
+            "created_at": now,
+            "expires_at": now + timedelta(hours=1),
             "is_used": False,
         }
 
+        # Store the token before emailing it, so a sent token is always redeemable
         await db.password_resets.insert_one(reset_doc)
-
-        # Send reset email
         try:
             await email_service.send_password_reset_email(request.email, reset_token)
         except Exception as e:
-            logger.warning(f"Failed to send password reset email: {str(e)}")
+            logger.warning("Failed to send password reset email: %s", e)
 
         return {"message": "If the email exists, a reset link has been sent"}
 
     except Exception as e:
-        logger.error(f"Password reset request error: {str(e)}")
+        logger.error("Password reset request error: %s", e)
         return {"message": "If the email exists, a reset link has been sent"}
 
 
@@ -1055,7 +1324,8 @@ async def reset_password(request: PasswordReset):
             }
         )
 
-        if not reset_record or reset_record["expires_at"] < datetime.utcnow():
+        now = datetime.utcnow()
+        if not reset_record or reset_record["expires_at"] < now:
             raise HTTPException(
                 status.HTTP_400_BAD_REQUEST, "Invalid or expired reset token"
             )
@@ -1067,25 +1337,25 @@ async def reset_password(request: PasswordReset):
             )
 
         # Update password
-        password_hash = hash_password(request.new_password)
+        password_hash = await asyncio.to_thread(hash_password, request.new_password)
         await db.users.update_one(
             {"email": request.email},
-            {"$set": {"password_hash": password_hash, "updated_at": datetime.utcnow()}},
+            {"$set": {"password_hash": password_hash, "updated_at": now}},
         )
 
         # Mark reset token as used
         await db.password_resets.update_one(
             {"_id": reset_record["_id"]},
-            {"$set": {"is_used": True, "used_at": datetime.utcnow()}},
+            {"$set": {"is_used": True, "used_at": now}},
         )
 
-        logger.info(f"Password reset successful for email: {request.email}")
+        logger.info("Password reset successful for email: %s", request.email)
         return {"message": "Password reset successfully"}
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Password reset error: {str(e)}")
+        logger.error("Password reset error: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Password reset failed"
         )
@@ -1137,13 +1407,9 @@ async def get_subscription_info(
 
 
 @api_router.get("/subscription/plans")
-async def get_subscription_plans():
+async def get_subscription_plans(request: Request):
     """Get available subscription plans and credit packs"""
-    return {
-        "subscription_plans": SUBSCRIPTION_PLANS,
-        "credit_packs": CREDIT_PACKS,
-        "credit_costs": CREDIT_COSTS,
-    }
+    return static_json_response(request, SUBSCRIPTION_PLANS_PAYLOAD)
 
 
 # Enhanced AI Orchestration Classes
@@ -1182,23 +1448,30 @@ User input: """
 
         try:
             # Use cost-effective model for classification
-            chat = (
-                LlmChat(
-                    api_key=OPENAI_API_KEY,
-                    session_id=f"classifier_{uuid.uuid4()}",
-                    system_message=classification_prompt,
+            if AsyncOpenAI is not None:
+                completion = await get_openai_client().chat.completions.create(
+                    model="gpt-4o-mini",
+                    max_tokens=100,
+                    messages=[
+                        {"role": "system", "content": classification_prompt},
+                        {"role": "user", "content": message},
+                    ],
                 )
-                .with_model("openai", "gpt-4o-mini")
-                .with_max_tokens(100)
-            )
-
-            user_message = UserMessage(text=message)
-            response = await chat.send_message(user_message)
+                response = completion.choices[0].message.content or ""
+            else:
+                chat = (
+                    LlmChat(
+                        api_key=OPENAI_API_KEY,
+                        session_id=f"classifier_{uuid.uuid4()}",
+                        system_message=classification_prompt,
+                    )
+                    .with_model("openai", "gpt-4o-mini")
+                    .with_max_tokens(100)
+                )
+                response = await chat.send_message(UserMessage(text=message))
 
             # Parse JSON response
-            import json
-
-            classification = json.loads(response.strip())
+            classification = orjson.loads(response.strip())
 
             # Validate classification
             if classification.get("complexity") not in ["LOW", "MEDIUM", "HIGH"]:
@@ -1214,7 +1487,7 @@ User input: """
             return classification
 
         except Exception as e:
-            logging.warning(f"Classification failed: {str(e)}")
+            logging.warning("Classification failed: %s", e)
             # Fallback classification
             return {"complexity": "MEDIUM", "intent": "CLARITY"}
 
@@ -1252,6 +1525,59 @@ class SmartModelRouter:
 
 
 # LLM Router with monetization
+# Per-call budget for a full (non-streamed) LLM response
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "45"))
+# Race both providers for Pro users on auto routing; doubles token spend
+LLM_RACE_FOR_PRO = os.environ.get("LLM_RACE_FOR_PRO") == "1"
+# Confidence reported for canned demo text when every provider failed
+DEMO_CONFIDENCE = 0.6
+
+
+class LLMReply(NamedTuple):
+    """An AI response and the model that actually produced it"""
+
+    response: str
+    confidence: float
+    llm_used: str  # "demo" when every provider failed
+    is_fallback: bool = False  # canned demo text rather than a model answer
+
+
+class LLMCircuitBreaker:
+    """Skips a provider for a while after repeated failures or timeouts"""
+
+    def __init__(self, max_failures: int = 5, window: float = 60, cooldown: float = 30):
+        self.max_failures = max_failures
+        self.window = window
+        self.cooldown = cooldown
+        self.failures = defaultdict(deque)  # provider -> failure timestamps
+        self.open_until = {}
+
+    def is_open(self, provider: str) -> bool:
+        return self.open_until.get(provider, 0.0) > time.monotonic()
+
+    def available(self, providers: tuple) -> tuple:
+        """Providers in preference order, minus open ones unless all are open"""
+        closed = tuple(p for p in providers if not self.is_open(p))
+        return closed or providers
+
+    def record_failure(self, provider: str):
+        now = time.monotonic()
+        failures = self.failures[provider]
+        failures.append(now)
+        while failures and now - failures[0] > self.window:
+            failures.popleft()
+        if len(failures) >= self.max_failures:
+            self.open_until[provider] = now + self.cooldown
+            failures.clear()
+            logging.warning("LLM circuit for %s open for %ss", provider, self.cooldown)
+
+    def record_success(self, provider: str):
+        self.failures.pop(provider, None)
+
+
+llm_circuit_breaker = LLMCircuitBreaker()
+
+
 class LLMRouter:
     """Intelligent LLM routing engine with monetization checks"""
 
@@ -1264,19 +1590,15 @@ class LLMRouter:
     ) -> str:
         """Determine the best LLM based on decision type and user plan"""
 
-        if user_preference in ["claude", "gpt4o"]:
+        if user_preference in ("claude", "gpt4o"):
             # Check if user has access to Claude
-            if (
-                user_preference == "claude"
-                and LLM_MODELS["claude"]["pro_only"]
-                and user_plan != "pro"
-            ):
+            if user_preference == "claude" and _CLAUDE_PRO_ONLY and user_plan != "pro":
                 return "gpt4o"  # Fallback to GPT-4o
             return user_preference
 
         # Auto-routing with plan restrictions
-        if category in LLM_MODELS["claude"]["best_for"] and user_plan == "pro":
-            return "claude"
+        if user_plan == "pro":
+            return _PRO_AUTO_ROUTES.get(category, "gpt4o")
 
         return "gpt4o"  # Default to GPT-4o for free users
 
@@ -1289,36 +1611,52 @@ class LLMRouter:
         conversation_history: List[dict] = None,
     ) -> tuple[str, float]:
         """Get response from specified LLM with fallback"""
+        reply = await LLMRouter.get_llm_reply(
+            message, llm_choice, session_id, system_message, conversation_history
+        )
+        return reply.response, reply.confidence
 
-        try:
-            if llm_choice == "claude":
-                return await LLMRouter._get_claude_response(
-                    message, session_id, system_message, conversation_history
-                )
-            elif llm_choice == "gpt4o":
-                return await LLMRouter._get_gpt4o_response(
-                    message, session_id, system_message, conversation_history
-                )
-            else:
-                raise ValueError(f"Unknown LLM choice: {llm_choice}")
-
-        except Exception as e:
-            logging.warning(f"Primary LLM ({llm_choice}) failed: {str(e)}")
-            fallback_llm = "gpt4o" if llm_choice == "claude" else "claude"
+    @staticmethod
+    async def get_llm_reply(
+        message: str,
+        llm_choice: str,
+        session_id: str,
+        system_message: str,
+        conversation_history: List[dict] = None,
+    ) -> LLMReply:
+        """get_llm_response, also reporting which model answered"""
+        providers = {
+            "claude": LLMRouter._get_claude_response,
+            "gpt4o": LLMRouter._get_gpt4o_response,
+        }
+        fallback_llm = "gpt4o" if llm_choice == "claude" else "claude"
+        candidates = llm_circuit_breaker.available((llm_choice, fallback_llm))
+
+        errors = []
+        for choice in candidates:
+            if choice not in providers:
+                errors.append(f"{choice}: unknown LLM choice")
+                continue
             try:
-                if fallback_llm == "claude":
-                    return await LLMRouter._get_claude_response(
-                        message, session_id, system_message, conversation_history
-                    )
-                else:
-                    return await LLMRouter._get_gpt4o_response(
+                # A hung provider call must not hold the request indefinitely
+                response, confidence = await asyncio.wait_for(
+                    providers[choice](
                         message, session_id, system_message, conversation_history
-                    )
-            except Exception as fallback_error:
-                logging.error(
-                    f"Both LLMs failed. Claude: {str(e)}, GPT-4o: {str(fallback_error)}"
+                    ),
+                    timeout=LLM_TIMEOUT_SECONDS,
                 )
-                return generate_demo_response(message), 0.6
+            except Exception as e:
+                llm_circuit_breaker.record_failure(choice)
+                logging.warning("LLM (%s) failed: %r", choice, e)
+                errors.append(f"{choice}: {e!r}")
+                continue
+            llm_circuit_breaker.record_success(choice)
+            return LLMReply(response, confidence, choice)
+
+        logging.error("All LLMs failed: %s", "; ".join(errors))
+        return LLMReply(
+            generate_demo_response(message), DEMO_CONFIDENCE, "demo", is_fallback=True
+        )
 
     @staticmethod
     async def _get_claude_response(
@@ -1328,23 +1666,29 @@ class LLMRouter:
         conversation_history: List[dict] = None,
     ) -> tuple[str, float]:
         """Get response from Claude"""
-        context_message = message
-        if conversation_history:
-            context = format_conversation_context(conversation_history)
-            context_message = context + f"\nUser's current message: {message}"
-
-        chat = (
-            LlmChat(
-                api_key=ANTHROPIC_API_KEY,
-                session_id=session_id,
-                system_message=system_message,
+        if AsyncAnthropic is not None:
+            reply = await get_anthropic_client().messages.create(
+                model="claude-sonnet-4-20250514",
+                max_tokens=4096,
+                system=system_message,
+                messages=claude_messages(conversation_history, message),
+            )
+            response = "".join(
+                block.text for block in reply.content if block.type == "text"
+            )
+        else:
+            chat = (
+                LlmChat(
+                    api_key=ANTHROPIC_API_KEY,
+                    session_id=session_id,
+                    system_message=system_message,
+                )
+                .with_model("anthropic", "claude-sonnet-4-20250514")
+                .with_max_tokens(4096)
+            )
+            response = await chat.send_message(
+                UserMessage(text=inline_context_message(conversation_history, message))
             )
-            .with_model("anthropic", "claude-sonnet-4-20250514")
-            .with_max_tokens(4096)
-        )
-
-        user_message = UserMessage(text=context_message)
-        response = await chat.send_message(user_message)
 
         confidence = 0.9
         return response, confidence
@@ -1357,113 +1701,339 @@ class LLMRouter:
         conversation_history: List[dict] = None,
     ) -> tuple[str, float]:
         """Get response from GPT-4o"""
-        context_message = message
-        if conversation_history:
-            context = format_conversation_context(conversation_history)
-            context_message = context + f"\nUser's current message: {message}"
-
-        chat = (
-            LlmChat(
-                api_key=OPENAI_API_KEY,
-                session_id=session_id,
-                system_message=system_message,
+        if AsyncOpenAI is not None:
+            completion = await get_openai_client().chat.completions.create(
+                model="gpt-4o",
+                max_tokens=4096,
+                messages=[
+                    {"role": "system", "content": system_message},
+                    *conversation_messages(conversation_history, message),
+                ],
+            )
+            response = completion.choices[0].message.content or ""
+        else:
+            chat = (
+                LlmChat(
+                    api_key=OPENAI_API_KEY,
+                    session_id=session_id,
+                    system_message=system_message,
+                )
+                .with_model("openai", "gpt-4o")
+                .with_max_tokens(4096)
+            )
+            response = await chat.send_message(
+                UserMessage(text=inline_context_message(conversation_history, message))
             )
-            .with_model("openai", "gpt-4o")
-            .with_max_tokens(4096)
-        )
-
-        user_message = UserMessage(text=context_message)
-        response = await chat.send_message(user_message)
 
         confidence = 0.85
         return response, confidence
 
+    @staticmethod
+    async def race_llm_response(
+        message: str,
+        session_id: str,
+        system_message: str,
+        conversation_history: List[dict] = None,
+    ) -> LLMReply:
+        """Ask Claude and GPT-4o at once and keep the first good answer"""
+        calls = {
+            "claude": LLMRouter._get_claude_response,
+            "gpt4o": LLMRouter._get_gpt4o_response,
+        }
+        # With every circuit open both are still tried, as in get_llm_reply
+        tasks = {
+            asyncio.create_task(
+                asyncio.wait_for(
+                    calls[choice](
+                        message, session_id, system_message, conversation_history
+                    ),
+                    timeout=LLM_TIMEOUT_SECONDS,
+                )
+            ): choice
+            for choice in llm_circuit_breaker.available(("claude", "gpt4o"))
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    choice = tasks[task]
+                    if task.exception() is None:
+                        llm_circuit_breaker.record_success(choice)
+                        response, confidence = task.result()
+                        return LLMReply(response, confidence, choice)
+                    llm_circuit_breaker.record_failure(choice)
+                    logging.warning("LLM (%s) failed: %r", choice, task.exception())
+        finally:
+            for task in pending:
+                task.cancel()
+
+        # Both providers already failed, so asking them again would only
+        # double the wait
+        logging.error("Both raced LLMs failed")
+        return LLMReply(
+            generate_demo_response(message), DEMO_CONFIDENCE, "demo", is_fallback=True
+        )
 
-def get_system_message(
-    category: str = "general", preferences: dict = None, advisor_style: str = "realist"
-) -> str:
-    """Generate a tailored system message based on category, preferences, and enhanced advisor style"""
+    @staticmethod
+    async def stream_llm_response(
+        message: str,
+        llm_choice: str,
+        session_id: str,
+        system_message: str,
+        conversation_history: List[dict] = None,
+    ):
+        """Yield (model that answered, text) as the LLM produces the response
+
+        Falls back like get_llm_reply, ending with the demo answer ("demo")
+        once every provider has failed.
+        """
+        streams = {
+            "claude": (
+                AsyncAnthropic,
+                LLMRouter._get_claude_response_stream,
+                LLMRouter._get_claude_response,
+            ),
+            "gpt4o": (
+                AsyncOpenAI,
+                LLMRouter._get_gpt4o_response_stream,
+                LLMRouter._get_gpt4o_response,
+            ),
+        }
+        fallback_llm = "gpt4o" if llm_choice == "claude" else "claude"
+
+        for choice in llm_circuit_breaker.available((llm_choice, fallback_llm)):
+            sdk, stream, call = streams[choice]
+            if sdk is None:
+                # Without the SDK there is nothing to stream from, so the
+                # whole answer arrives as one chunk
+                chunks = LLMRouter._whole_response(
+                    call, message, session_id, system_message, conversation_history
+                )
+            else:
+                chunks = stream(message, system_message, conversation_history)
+            started = False
+            try:
+                async for text in chunks:
+                    started = True
+                    yield choice, text
+                llm_circuit_breaker.record_success(choice)
+                return
+            except Exception as e:
+                # Text already sent can't be taken back, so only fall back
+                # when nothing has been streamed yet; a cut-off answer must
+                # reach the caller as an error, not as a finished turn
+                llm_circuit_breaker.record_failure(choice)
+                if started:
+                    logging.error("LLM stream (%s) failed midway: %s", choice, e)
+                    raise
+                logging.warning("LLM stream (%s) failed: %s", choice, e)
+
+        # Every provider was already tried, so asking them again would only
+        # double the wait
+        logging.error("All LLM streams failed")
+        yield "demo", generate_demo_response(message)
 
-    advisor_config = ADVISOR_STYLES.get(advisor_style, ADVISOR_STYLES["realist"])
+    @staticmethod
+    async def _whole_response(
+        call,
+        message: str,
+        session_id: str,
+        system_message: str,
+        conversation_history: List[dict] = None,
+    ):
+        """Yield a non-streaming provider's response as a single chunk"""
+        response, _ = await asyncio.wait_for(
+            call(message, session_id, system_message, conversation_history),
+            timeout=LLM_TIMEOUT_SECONDS,
+        )
+        yield response
 
-    base_prompt = f"""You are getgingee's {advisor_config['name']} Advisor, an AI-powered personal decision assistant.
+    @staticmethod
+    async def _get_claude_response_stream(
+        message: str, system_message: str, conversation_history: List[dict] = None
+    ):
+        """Stream a response from Claude"""
+        async with get_anthropic_client().messages.stream(
+            model="claude-sonnet-4-20250514",
+            max_tokens=4096,
+            system=system_message,
+            messages=claude_messages(conversation_history, message),
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
 
-🎭 YOUR ADVISOR PERSONALITY:
-Name: {advisor_config['name']} Advisor
-Motto: "{advisor_config['motto']}"
-Core Traits: {', '.join(advisor_config['traits'])}
-Communication Tone: {advisor_config['tone']}
-Decision Framework: {advisor_config['framework']}
-Decision Weighting: {advisor_config['decision_weight']}
-Language Style: {advisor_config['language_style']}
+    @staticmethod
+    async def _get_gpt4o_response_stream(
+        message: str, system_message: str, conversation_history: List[dict] = None
+    ):
+        """Stream a response from GPT-4o"""
+        stream = await get_openai_client().chat.completions.create(
+            model="gpt-4o",
+            max_tokens=4096,
+            stream=True,
+            messages=[
+                {"role": "system", "content": system_message},
+                *conversation_messages(conversation_history, message),
+            ],
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
-🎯 PERSONALITY-SPECIFIC BEHAVIOR:
-"""
 
-    # Add personality-specific instructions
-    if advisor_style == "optimistic":
-        base_prompt += """
+def claude_messages(conversations: List[dict], message: str) -> List[dict]:
+    """conversation_messages with an Anthropic cache breakpoint after the history
+
+    The system prompt alone is below the 1024-token minimum for a cacheable
+    prefix, so the breakpoint goes on the last prior turn: once system prompt
+    plus history is long enough, the next turn reads that prefix from the
+    cache while the history window hasn't moved.
+    """
+    messages = conversation_messages(conversations, message)
+    if len(messages) > 1:
+        prior = messages[-2]
+        messages[-2] = {
+            "role": prior["role"],
+            "content": [
+                {
+                    "type": "text",
+                    "text": prior["content"],
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+        }
+    return messages
+
+
+def build_llm_http_client() -> httpx.AsyncClient:
+    """HTTP client kept alive across LLM calls instead of one per request"""
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+        timeout=httpx.Timeout(120.0, connect=10.0),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_anthropic_client():
+    """Shared Anthropic client, so calls reuse its connection pool"""
+    return AsyncAnthropic(
+        api_key=ANTHROPIC_API_KEY, http_client=build_llm_http_client()
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_openai_client():
+    """Shared OpenAI client, so calls reuse its connection pool"""
+    return AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=build_llm_http_client())
+
+
+async def embed_message(message: str) -> List[float]:
+    """Embed a chat message for semantic cache lookups"""
+    result = await get_openai_client().embeddings.create(
+        model="text-embedding-3-small", input=message
+    )
+    return result.data[0].embedding
+
+
+# Reuse answers to semantically equivalent first messages; needs RediSearch
+# and the OpenAI SDK, and serves one user's answer to another, so opt-in
+semantic_cache = (
+    SemanticCache(auth_cache.redis, embed_message)
+    if os.environ.get("SEMANTIC_CACHE") == "1"
+    and auth_cache.redis is not None
+    and AsyncOpenAI is not None
+    else None
+)
+
+
+async def close_llm_clients():
+    """Close whichever LLM clients were created"""
+    for get_client in (get_anthropic_client, get_openai_client):
+        if get_client.cache_info().currsize:
+            await get_client().close()
+            get_client.cache_clear()
+
+
+# Personality-specific prompt instructions per advisor style
+_STYLE_INSTRUCTIONS = {
+    "optimistic": """
 - Always lead with possibilities and positive outcomes
 - Reframe challenges as opportunities for growth
 - Use encouraging language and action-oriented suggestions
 - Focus on potential benefits and success scenarios
-- End responses with motivational next steps"""
-
-    elif advisor_style == "skeptical":
-        base_prompt += """
+- End responses with motivational next steps""",
+    "skeptical": """
 - Thoroughly examine potential risks and downsides
 - Ask "what could go wrong?" for each option
 - Provide detailed caveats and considerations
 - Validate assumptions with evidence
-- Emphasize due diligence and careful planning"""
-
-    elif advisor_style == "creative":
-        base_prompt += """
+- Emphasize due diligence and careful planning""",
+    "creative": """
 - Use rich metaphors and imaginative language
 - Suggest unconventional approaches and alternatives
 - Reframe problems from multiple creative angles
 - Think outside traditional decision frameworks
-- Inspire with innovative possibilities"""
-
-    elif advisor_style == "analytical":
-        base_prompt += """
+- Inspire with innovative possibilities""",
+    "analytical": """
 - Use data, numbers, and quantifiable metrics
 - Structure responses with clear logical frameworks
 - Provide step-by-step methodical analysis
 - Reference evidence and concrete facts
-- Create scoring matrices when appropriate"""
-
-    elif advisor_style == "intuitive":
-        base_prompt += """
+- Create scoring matrices when appropriate""",
+    "intuitive": """
 - Trust and validate emotional responses
 - Ask about gut feelings and inner wisdom
 - Consider how decisions align with values
 - Use warm, empathetic language
-- Focus on holistic well-being and fulfillment"""
-
-    elif advisor_style == "visionary":
-        base_prompt += """
+- Focus on holistic well-being and fulfillment""",
+    "visionary": """
 - Think in terms of long-term impact and legacy
 - Paint bold pictures of future possibilities
 - Consider strategic implications and transformative potential
 - Use inspiring, forward-thinking language
-- Challenge conventional thinking with big-picture perspective"""
-
-    elif advisor_style == "supportive":
-        base_prompt += """
+- Challenge conventional thinking with big-picture perspective""",
+    "supportive": """
 - Provide emotional validation and encouragement
 - Acknowledge the difficulty of decision-making
 - Use gentle, understanding language
 - Focus on emotional well-being throughout the process
-- Build confidence while providing guidance"""
-
-    else:  # realist
-        base_prompt += """
+- Build confidence while providing guidance""",
+    "realist": """
 - Provide balanced, objective analysis
 - Weigh pros and cons systematically
 - Use practical, straightforward language
 - Focus on realistic outcomes and expectations
-- Deliver efficient, well-structured guidance"""
+- Deliver efficient, well-structured guidance""",
+}
+
+
+@functools.lru_cache(maxsize=512)
+def _build_system_message(category: str, advisor_style: str) -> tuple[str, str]:
+    """Build the parts of the system message around the user preferences"""
+    advisor_config = ADVISOR_STYLES.get(advisor_style, ADVISOR_STYLES["realist"])
+
+    base_prompt = f"""You are getgingee's {advisor_config['name']} Advisor, an AI-powered personal decision assistant.
+
+🎭 YOUR ADVISOR PERSONALITY:
+Name: {advisor_config['name']} Advisor
+Motto: "{advisor_config['motto']}"
+Core Traits: {', '.join(advisor_config['traits'])}
+Communication Tone: {advisor_config['tone']}
+Decision Framework: {advisor_config['framework']}
+Decision Weighting: {advisor_config['decision_weight']}
+Language Style: {advisor_config['language_style']}
+
+🎯 PERSONALITY-SPECIFIC BEHAVIOR:
+"""
+
+    # Add personality-specific instructions
+    base_prompt += _STYLE_INSTRUCTIONS.get(
+        advisor_style, _STYLE_INSTRUCTIONS["realist"]
+    )
 
     base_prompt += f"""
 
@@ -1481,15 +2051,73 @@ Important: This is a continuing conversation. Reference previous messages and bu
         category_context = DECISION_CATEGORIES.get(category, "")
         base_prompt += f"\n\n🎯 DECISION CATEGORY: You are helping with {category} decisions. Focus on: {category_context}"
 
+    closing = f"\n\nMaintain your {advisor_config['name']} personality while being helpful and building user confidence in their decision-making process."
+
+    return base_prompt, closing
+
+
+def get_system_message(
+    category: str = "general", preferences: dict = None, advisor_style: str = "realist"
+) -> str:
+    """Generate a tailored system message based on category, preferences, and enhanced advisor style"""
+    # Only the preferences vary per user, so the rest is built once per
+    # (category, advisor style)
+    base_prompt, closing = _build_system_message(category, advisor_style)
+
     if preferences:
         pref_text = ", ".join([f"{k}: {v}" for k, v in preferences.items() if v])
         base_prompt += (
             f"\n\n🎯 USER PREFERENCES: Consider these preferences: {pref_text}"
         )
 
-    base_prompt += f"\n\nMaintain your {advisor_config['name']} personality while being helpful and building user confidence in their decision-making process."
+    return base_prompt + closing
+
+
+# Prior turns sent with each message are capped by tokens, not turn count,
+# so long answers can't crowd out the prompt or its cacheable prefix
+MAX_HISTORY_TOKENS = 2048
+MAX_HISTORY_TURNS = 5
 
-    return base_prompt
+
+@functools.lru_cache(maxsize=None)
+def get_token_encoding():
+    """The cl100k tokenizer, or None when tiktoken can't provide it
+
+    Loaded on first use: a cold tiktoken cache downloads the BPE file, which
+    must not block imports or break offline deployments.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logging.warning("tiktoken encoding unavailable, estimating tokens: %s", e)
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count of text, estimated when tiktoken is unavailable"""
+    encoding = get_token_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def recent_history(conversations: List[dict]) -> List[dict]:
+    """The newest turns that fit MAX_HISTORY_TOKENS, oldest first"""
+    kept = []
+    budget = MAX_HISTORY_TOKENS
+    for conv in reversed((conversations or [])[-MAX_HISTORY_TURNS:]):
+        tokens = conv.get("token_count") or count_tokens(
+            conv["user_message"] + conv["ai_response"]
+        )
+        # Always keep the latest turn so follow-ups have something to refer to
+        if kept and tokens > budget:
+            break
+        kept.append(conv)
+        budget -= tokens
+    kept.reverse()
+    return kept
 
 
 def format_conversation_context(conversations: List[dict]) -> str:
@@ -1498,7 +2126,7 @@ def format_conversation_context(conversations: List[dict]) -> str:
         return ""
 
     context = "\n\nPrevious conversation context:\n"
-    for conv in conversations[-5:]:
+    for conv in recent_history(conversations):
         context += f"User: {conv['user_message']}\n"
         context += f"Assistant: {conv['ai_response']}\n\n"
 
@@ -1508,227 +2136,540 @@ def format_conversation_context(conversations: List[dict]) -> str:
     return context
 
 
-@api_router.post("/chat", response_model=DecisionResponse)
-async def chat_with_assistant(
-    request: DecisionRequest, current_user: dict = Depends(get_current_user)
-):
-    """Main chat endpoint with monetization and feature gating"""
-    try:
-        # Security: Sanitize user input
-        request.message = security_service.sanitize_input(request.message)
-
-        # Check permissions and usage
-        permission_check = await check_usage_and_permissions(
-            current_user,
-            request.use_voice,
-            request.advisor_style,
-            request.llm_preference,
-        )
+def conversation_messages(conversations: List[dict], message: str) -> List[dict]:
+    """Prior turns as chat messages followed by the new user message
 
-        if not permission_check["allowed"]:
-            raise HTTPException(
-                status.HTTP_403_FORBIDDEN,
-                {
-                    "errors": permission_check["errors"],
-                    "credit_cost": permission_check["credit_cost"],
-                },
-            )
+    Keeping earlier turns verbatim and the new message last keeps the prompt
+    prefix stable between turns, so providers can cache it.
+    """
+    messages = []
+    for conv in recent_history(conversations):
+        messages.append({"role": "user", "content": conv["user_message"]})
+        if conv.get("ai_response"):
+            messages.append({"role": "assistant", "content": conv["ai_response"]})
+    messages.append({"role": "user", "content": message})
+    return messages
 
-        credit_cost = permission_check["credit_cost"]
-        decision_id = request.decision_id or str(uuid.uuid4())
 
-        # Get or create decision session
-        existing_session = await db.decision_sessions.find_one(
-            {"decision_id": decision_id, "user_id": current_user["id"]}
+def inline_context_message(conversations: List[dict], message: str) -> str:
+    """Single user message with the history inlined, for LlmChat"""
+    if not conversations:
+        return message
+    context = format_conversation_context(conversations)
+    return context + f"\nUser's current message: {message}"
+
+
+# Only what the prompt builders read from earlier turns
+CHAT_HISTORY_PROJECTION = {
+    "_id": 0,
+    "user_message": 1,
+    "ai_response": 1,
+    "token_count": 1,
+}
+
+
+def decision_session_upsert(
+    request: DecisionRequest, session_filter: dict, credit_cost: int
+) -> List[dict]:
+    """Pipeline update that creates a decision session or records a new turn"""
+    new_session = DecisionSession.model_construct(
+        **session_filter,
+        title=generate_decision_title(request.message, request.category),
+        category=request.category or "general",
+        user_preferences=request.preferences or {},
+        llm_preference=request.llm_preference,
+        advisor_style=request.advisor_style,
+    ).model_dump()
+
+    # Values on an existing session; every other field keeps its stored value
+    turn_update = {
+        "last_active": {"$literal": new_session["last_active"]},
+        "message_count": {"$add": [{"$ifNull": ["$message_count", 0]}, 1]},
+        "llm_preference": {"$literal": request.llm_preference},
+        "advisor_style": {"$literal": request.advisor_style},
+        "total_credits_used": {
+            "$add": [{"$ifNull": ["$total_credits_used", 0]}, credit_cost]
+        },
+    }
+    if request.preferences:
+        turn_update["user_preferences"] = {
+            "$mergeObjects": [
+                {"$ifNull": ["$user_preferences", {}]},
+                {"$literal": request.preferences},
+            ]
+        }
+
+    # An upserted document only has the filter fields, so a missing id marks
+    # a session being created; $literal keeps user text from being read as
+    # field paths
+    is_new = {"$eq": [{"$type": "$id"}, "missing"]}
+    return [
+        {
+            "$set": {
+                field: {
+                    "$cond": [
+                        is_new,
+                        {"$literal": value},
+                        turn_update.get(field, f"${field}"),
+                    ]
+                }
+                for field, value in new_session.items()
+                if field not in session_filter
+            }
+        }
+    ]
+
+
+async def prepare_chat_turn(request: DecisionRequest, current_user: dict) -> dict:
+    """Check permissions, update the decision session and pick the LLM"""
+    # Security: Sanitize user input
+    request.message = security_service.sanitize_input(request.message)
+
+    # Check permissions and usage
+    permission_check = await check_usage_and_permissions(
+        current_user,
+        request.use_voice,
+        request.advisor_style,
+        request.llm_preference,
+    )
+
+    if not permission_check["allowed"]:
+        raise HTTPException(
+            status.HTTP_403_FORBIDDEN,
+            {
+                "errors": permission_check["errors"],
+                "credit_cost": permission_check["credit_cost"],
+            },
         )
-        if not existing_session:
-            title = generate_decision_title(request.message, request.category)
-            session_obj = DecisionSession(
-                decision_id=decision_id,
-                user_id=current_user["id"],
-                title=title,
-                category=request.category or "general",
-                user_preferences=request.preferences or {},
-                llm_preference=request.llm_preference,
-                advisor_style=request.advisor_style,
+
+    credit_cost = permission_check["credit_cost"]
+    decision_id = request.decision_id or str(uuid.uuid4())
+
+    # Create or update the decision session and load its history together
+    session_filter = {"decision_id": decision_id, "user_id": current_user["id"]}
+    session_data, conversation_history = await asyncio.gather(
+        db.decision_sessions.find_one_and_update(
+            session_filter,
+            decision_session_upsert(request, session_filter, credit_cost),
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        ),
+        db.conversations.find(session_filter, CHAT_HISTORY_PROJECTION)
+        .sort("timestamp", -1)
+        .limit(MAX_HISTORY_TURNS)
+        .to_list(MAX_HISTORY_TURNS),
+    )
+    conversation_history.reverse()
+
+    user_preferences = session_data.get("user_preferences", {}) if session_data else {}
+    category = (
+        session_data.get("category", "general")
+        if session_data
+        else (request.category or "general")
+    )
+    advisor_style = (
+        session_data.get("advisor_style", "realist")
+        if session_data
+        else request.advisor_style
+    )
+
+    # Determine LLM with plan restrictions
+    llm_choice = LLMRouter.determine_best_llm(
+        category,
+        request.message,
+        request.llm_preference,
+        current_user.get("plan", "free"),
+    )
+
+    return {
+        "decision_id": decision_id,
+        "credit_cost": credit_cost,
+        "category": category,
+        "advisor_style": advisor_style,
+        "llm_choice": llm_choice,
+        "system_message": get_system_message(category, user_preferences, advisor_style),
+        "conversation_history": conversation_history,
+    }
+
+
+async def record_chat_turn(
+    request: DecisionRequest,
+    current_user: dict,
+    turn: dict,
+    ai_response: str,
+    charge: bool = True,
+):
+    """Charge the user for a completed turn and store the conversation"""
+    credit_cost = turn["credit_cost"]
+
+    # Deduct credits and update usage
+    plan = current_user.get("plan", "free")
+    if charge and plan == "free":
+        monthly_used = current_user.get("monthly_decisions_used", 0)
+        if monthly_used < SUBSCRIPTION_PLANS["free"]["monthly_decisions"]:
+            # Use free decision
+            await db.users.update_one(
+                {"id": current_user["id"]}, {"$inc": {"monthly_decisions_used": 1}}
             )
-            await db.decision_sessions.insert_one(session_obj.dict())
         else:
-            update_data = {
-                "last_active": datetime.utcnow(),
-                "message_count": existing_session.get("message_count", 0) + 1,
-                "llm_preference": request.llm_preference,
-                "advisor_style": request.advisor_style,
-                "total_credits_used": existing_session.get("total_credits_used", 0)
-                + credit_cost,
-            }
-            if request.preferences:
-                update_data["user_preferences"] = {
-                    **existing_session.get("user_preferences", {}),
-                    **request.preferences,
-                }
-
-            await db.decision_sessions.update_one(
-                {"decision_id": decision_id, "user_id": current_user["id"]},
-                {"$set": update_data},
+            # Use credits
+            await db.users.update_one(
+                {"id": current_user["id"]}, {"$inc": {"credits": -credit_cost}}
             )
+        await auth_cache.invalidate(current_user["id"])
+    # Pro users don't have limits, so no deduction needed
+
+    # Store conversation; every field is server-built, so skip validation
+    conversation = ConversationHistory.model_construct(
+        decision_id=turn["decision_id"],
+        user_id=current_user["id"],
+        user_message=request.message,
+        ai_response=ai_response,
+        category=turn["category"],
+        preferences=request.preferences,
+        llm_used=turn["llm_choice"],
+        advisor_style=turn["advisor_style"],
+        advisor_personality=ADVISOR_STYLES.get(
+            turn["advisor_style"], ADVISOR_STYLES["realist"]
+        ),
+        credits_used=credit_cost,
+        # Stored so later turns can budget history without re-encoding it
+        token_count=count_tokens(request.message + ai_response),
+    )
+    await db.conversations.insert_one(conversation.model_dump())
 
-        # Get conversation history
-        conversation_history = (
-            await db.conversations.find(
-                {"decision_id": decision_id, "user_id": current_user["id"]}
-            )
-            .sort("timestamp", 1)
-            .to_list(20)
+
+async def record_chat_turn_logged(*args):
+    """record_chat_turn for after the response, when errors can only be logged"""
+    try:
+        await record_chat_turn(*args)
+    except Exception as e:
+        logging.error("Error recording chat turn: %s", e)
+
+
+async def run_chat_turn(
+    request: DecisionRequest,
+    current_user: dict,
+    charge: bool = True,
+    background_tasks: Optional[BackgroundTasks] = None,
+) -> DecisionResponse:
+    """Answer one chat message end to end
+
+    With background_tasks, charging and storing the turn happen after the
+    response is sent instead of before.
+    """
+    turn = await prepare_chat_turn(request, current_user)
+
+    # Cached answers only fit opening messages, since later turns depend on
+    # the conversation so far
+    cached, vector = None, None
+    if semantic_cache is not None and not turn["conversation_history"]:
+        cached, vector = await semantic_cache.lookup(
+            request.message, turn["system_message"], turn["advisor_style"]
         )
 
-        session_data = await db.decision_sessions.find_one(
-            {"decision_id": decision_id, "user_id": current_user["id"]}
+    # Get AI response
+    is_fallback = False
+    if cached is not None:
+        ai_response, confidence = cached["response"], cached["confidence"]
+    else:
+        if (
+            LLM_RACE_FOR_PRO
+            and request.llm_preference == "auto"
+            and current_user.get("plan") == "pro"
+        ):
+            reply = await LLMRouter.race_llm_response(
+                request.message,
+                turn["decision_id"],
+                turn["system_message"],
+                turn["conversation_history"],
+            )
+        else:
+            reply = await LLMRouter.get_llm_reply(
+                request.message,
+                turn["llm_choice"],
+                turn["decision_id"],
+                turn["system_message"],
+                turn["conversation_history"],
+            )
+        # Record the model that answered, not the one first asked
+        ai_response, confidence, turn["llm_choice"], is_fallback = reply
+
+    if background_tasks is not None:
+        background_tasks.add_task(
+            record_chat_turn_logged, request, current_user, turn, ai_response, charge
         )
-        user_preferences = (
-            session_data.get("user_preferences", {}) if session_data else {}
+    else:
+        await record_chat_turn(request, current_user, turn, ai_response, charge)
+
+    # Demo text answered because every provider failed; never serve it to others
+    if vector is not None and cached is None and not is_fallback:
+        cache_args = (
+            vector,
+            turn["system_message"],
+            turn["advisor_style"],
+            turn["category"],
+            ai_response,
+            confidence,
         )
-        category = (
-            session_data.get("category", "general")
-            if session_data
-            else (request.category or "general")
+        if background_tasks is not None:
+            background_tasks.add_task(semantic_cache.store, *cache_args)
+        else:
+            await semantic_cache.store(*cache_args)
+
+    advisor_style = turn["advisor_style"]
+    return DecisionResponse.model_construct(
+        decision_id=turn["decision_id"],
+        response=ai_response,
+        category=turn["category"],
+        llm_used=turn["llm_choice"],
+        confidence_score=confidence,
+        reasoning_type=determine_reasoning_type(
+            request.message, turn["category"], advisor_style
+        ),
+        advisor_personality=ADVISOR_STYLES.get(
+            advisor_style, ADVISOR_STYLES["realist"]
+        ),
+        credits_used=turn["credit_cost"],
+    )
+
+
+@api_router.post("/chat", response_model=DecisionResponse)
+async def chat_with_assistant(
+    request: DecisionRequest,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user),
+):
+    """Main chat endpoint with monetization and feature gating"""
+    try:
+        return await run_chat_turn(
+            request, current_user, background_tasks=background_tasks
         )
-        advisor_style = (
-            session_data.get("advisor_style", "realist")
-            if session_data
-            else request.advisor_style
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error("Error in chat endpoint: %s", e)
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, f"Error processing request: {str(e)}"
         )
 
-        # Determine LLM with plan restrictions
-        llm_choice = LLMRouter.determine_best_llm(
-            category,
-            request.message,
-            request.llm_preference,
-            current_user.get("plan", "free"),
-        )
 
-        system_message = get_system_message(category, user_preferences, advisor_style)
+MAX_BATCH_DECISIONS = 50
+BATCH_CONCURRENCY = 10
 
-        # Get AI response
-        ai_response, confidence = await LLMRouter.get_llm_response(
-            request.message,
-            llm_choice,
-            decision_id,
-            system_message,
-            conversation_history,
-        )
 
-        reasoning_type = determine_reasoning_type(
-            request.message, category, advisor_style
+def split_free_and_paid(user: dict, costs: List[int]) -> tuple[int, int]:
+    """Split a free user's turns into free monthly decisions and credits owed"""
+    if user.get("plan", "free") != "free":
+        return 0, 0
+    free_left = max(0, _FREE_MONTHLY_LIMIT - user.get("monthly_decisions_used", 0))
+    return min(free_left, len(costs)), sum(costs[free_left:])
+
+
+@api_router.post("/decision/batch")
+async def batch_decisions(
+    requests: List[DecisionRequest], current_user: dict = Depends(get_current_user)
+):
+    """Answer several chat messages concurrently with one usage check and charge"""
+    if not requests:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "No decisions provided")
+    if len(requests) > MAX_BATCH_DECISIONS:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"At most {MAX_BATCH_DECISIONS} decisions per batch",
         )
-        advisor_personality = ADVISOR_STYLES.get(
-            advisor_style, ADVISOR_STYLES["realist"]
+
+    try:
+        # Apply any monthly reset or plan expiry, then check the whole batch
+        # against the user's allowance up front
+        await check_usage_and_permissions(current_user)
+        costs = [_DECISION_CREDIT_COSTS[bool(r.use_voice)] for r in requests]
+        _, credits_needed = split_free_and_paid(current_user, costs)
+        if credits_needed > current_user.get("credits", 0):
+            raise HTTPException(
+                status.HTTP_403_FORBIDDEN,
+                {
+                    "errors": [
+                        f"Insufficient credits. Need {credits_needed} credits for this batch."
+                    ],
+                    "credit_cost": credits_needed,
+                },
+            )
+
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def run_one(request: DecisionRequest):
+            async with semaphore:
+                return await run_chat_turn(request, current_user, charge=False)
+
+        results = await asyncio.gather(
+            *(run_one(r) for r in requests), return_exceptions=True
         )
 
-        # Deduct credits and update usage
-        plan = current_user.get("plan", "free")
-        if plan == "free":
-            monthly_used = current_user.get("monthly_decisions_used", 0)
-            if monthly_used < SUBSCRIPTION_PLANS["free"]["monthly_decisions"]:
-                # Use free decision
-                await db.users.update_one(
-                    {"id": current_user["id"]}, {"$inc": {"monthly_decisions_used": 1}}
-                )
+        # Charge once for the turns that succeeded
+        succeeded = [
+            cost
+            for cost, result in zip(costs, results)
+            if not isinstance(result, BaseException)
+        ]
+        free_used, credits_used = split_free_and_paid(current_user, succeeded)
+        if free_used or credits_used:
+            await db.users.update_one(
+                {"id": current_user["id"]},
+                {
+                    "$inc": {
+                        "monthly_decisions_used": free_used,
+                        "credits": -credits_used,
+                    }
+                },
+            )
+            await auth_cache.invalidate(current_user["id"])
+
+        responses = []
+        for result in results:
+            if isinstance(result, HTTPException):
+                responses.append({"error": result.detail})
+            elif isinstance(result, BaseException):
+                logging.error("Error in batch decision: %s", result)
+                responses.append({"error": "Error processing request"})
             else:
-                # Use credits
-                await db.users.update_one(
-                    {"id": current_user["id"]}, {"$inc": {"credits": -credit_cost}}
-                )
-        # Pro users don't have limits, so no deduction needed
+                responses.append(result)
+        return {"results": responses}
 
-        # Store conversation
-        conversation = ConversationHistory(
-            decision_id=decision_id,
-            user_id=current_user["id"],
-            user_message=request.message,
-            ai_response=ai_response,
-            category=category,
-            preferences=request.preferences,
-            llm_used=llm_choice,
-            advisor_style=advisor_style,
-            advisor_personality=advisor_personality,
-            credits_used=credit_cost,
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error("Error in batch decision endpoint: %s", e)
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, "Error processing batch"
         )
-        await db.conversations.insert_one(conversation.dict())
 
-        return DecisionResponse(
-            decision_id=decision_id,
-            response=ai_response,
-            category=category,
-            llm_used=llm_choice,
-            confidence_score=confidence,
-            reasoning_type=reasoning_type,
-            advisor_personality=advisor_personality,
-            credits_used=credit_cost,
-        )
 
+def sse_event(event: str, data: dict) -> bytes:
+    """Encode one server-sent event"""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+@api_router.post("/chat/stream")
+@api_router.post("/decision/stream")
+async def stream_decision(
+    request: DecisionRequest, current_user: dict = Depends(get_current_user)
+):
+    """Chat endpoint that streams the AI response as server-sent events"""
+    try:
+        turn = await prepare_chat_turn(request, current_user)
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error in chat endpoint: {str(e)}")
+        logging.error("Error in decision stream endpoint: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, f"Error processing request: {str(e)}"
         )
 
+    def start_event() -> bytes:
+        return sse_event(
+            "start",
+            {
+                "decision_id": turn["decision_id"],
+                "category": turn["category"],
+                "llm_used": turn["llm_choice"],
+                "credits_used": turn["credit_cost"],
+            },
+        )
+
+    async def events():
+        # Sent with the first text, once the model that answers is known
+        started = False
+        try:
+            async for llm_used, text in LLMRouter.stream_llm_response(
+                request.message,
+                turn["llm_choice"],
+                turn["decision_id"],
+                turn["system_message"],
+                turn["conversation_history"],
+            ):
+                if not started:
+                    # Record the model that answered, not the one first asked
+                    turn["llm_choice"] = llm_used
+                    started = True
+                    yield start_event()
+                parts.append(text)
+                yield sse_event("delta", {"text": text})
+        except Exception as e:
+            logging.error("Error streaming decision response: %s", e)
+            if not started:
+                yield start_event()
+            yield sse_event("error", {"detail": "Error processing request"})
+            return
+
+        if not started:
+            yield start_event()
+        completed.set()
+        yield sse_event("done", {"decision_id": turn["decision_id"]})
+
+    async def record_completed_turn():
+        # Runs after the last event is flushed; a client that disconnected
+        # early didn't get the full answer, so it isn't charged for it
+        if completed.is_set():
+            await record_chat_turn_logged(request, current_user, turn, "".join(parts))
+
+    parts = []
+    completed = asyncio.Event()
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(record_completed_turn),
+    )
+
 
 # GDPR Compliance Endpoints
 @api_router.get("/auth/export-data")
 async def export_user_data(current_user: dict = Depends(get_current_user)):
     """Export all user data for GDPR compliance"""
-    try:
-        user_id = current_user["id"]
-
-        # Gather all user data
-        user_data = {
-            "personal_information": {
-                "id": current_user["id"],
-                "name": current_user.get("name", ""),
-                "email": current_user["email"],
-                "plan": current_user["plan"],
-                "created_at": current_user["created_at"],
-                "last_login": current_user.get("last_login"),
-                "email_verified": current_user.get("email_verified", False),
-            },
-            "usage_data": {
-                "monthly_decisions_used": current_user.get("monthly_decisions_used", 0),
-                "credits": current_user.get("credits", 0),
-                "subscription_expires": current_user.get("subscription_expires"),
-            },
-        }
-
-        # Get decision sessions
-        decision_sessions = []
-        async for session in db.decision_sessions_new.find({"user_id": user_id}):
-            session["_id"] = str(session["_id"])  # Convert ObjectId to string
-            decision_sessions.append(session)
-
-        user_data["decision_sessions"] = decision_sessions
-
-        # Get conversation history
-        conversations = []
-        async for conversation in db.conversation_history.find({"user_id": user_id}):
-            conversation["_id"] = str(conversation["_id"])
-            conversations.append(conversation)
+    user_id = current_user["id"]
+    personal_information = {
+        "id": current_user["id"],
+        "name": current_user.get("name", ""),
+        "email": current_user["email"],
+        "plan": current_user["plan"],
+        "created_at": current_user["created_at"],
+        "last_login": current_user.get("last_login"),
+        "email_verified": current_user.get("email_verified", False),
+    }
+    usage_data = {
+        "monthly_decisions_used": current_user.get("monthly_decisions_used", 0),
+        "credits": current_user.get("credits", 0),
+        "subscription_expires": current_user.get("subscription_expires"),
+    }
 
-        user_data["conversation_history"] = conversations
+    def dumps(value) -> bytes:
+        return orjson.dumps(value, default=orjson_default)
 
-        # Return as downloadable JSON
-        return {
-            "message": "User data export completed",
-            "export_date": datetime.utcnow().isoformat(),
-            "data": user_data,
-        }
+    async def generate_export():
+        # The same JSON document as before, with decision sessions and
+        # conversation history written out a cursor batch at a time
+        try:
+            yield (
+                b'{"message":"User data export completed","export_date":'
+                + dumps(datetime.utcnow().isoformat())
+                + b',"data":{"personal_information":'
+                + dumps(personal_information)
+                + b',"usage_data":'
+                + dumps(usage_data)
+                + b',"decision_sessions":['
+            )
+            async for chunk in stream_json_array(db.decision_sessions_new, user_id):
+                yield chunk
+            yield b'],"conversation_history":['
+            async for chunk in stream_json_array(db.conversation_history, user_id):
+                yield chunk
+            yield b"]}}"
+        except Exception as e:
+            # Headers are already sent, so the truncated body is the error
+            logging.error("Error exporting user data: %s", e)
 
-    except Exception as e:
-        logging.error(f"Error exporting user data: {str(e)}")
-        raise HTTPException(
-            status.HTTP_500_INTERNAL_SERVER_ERROR, "Error exporting user data"
-        )
+    return StreamingResponse(generate_export(), media_type="application/json")
 
 
 @api_router.delete("/auth/delete-account")
@@ -1739,13 +2680,14 @@ async def delete_user_account(current_user: dict = Depends(get_current_user)):
 
         # Delete user data from all collections
         await db.users.delete_one({"id": user_id})
+        await auth_cache.invalidate(user_id)
         await db.decision_sessions_new.delete_many({"user_id": user_id})
         await db.conversation_history.delete_many({"user_id": user_id})
         await db.decision_sessions.delete_many({"user_id": user_id})  # Old format
 
         # Log the deletion for audit purposes
         logging.info(
-            f"Account deleted for user: {current_user['email']} (ID: {user_id})"
+            "Account deleted for user: %s (ID: %s)", current_user["email"], user_id
         )
 
         return {
@@ -1755,39 +2697,47 @@ async def delete_user_account(current_user: dict = Depends(get_current_user)):
         }
 
     except Exception as e:
-        logging.error(f"Error deleting user account: {str(e)}")
+        logging.error("Error deleting user account: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Error deleting account"
         )
 
 
+_ADVISOR_REASONING = {
+    "optimistic": "Opportunity-Focused Analysis",
+    "skeptical": "Risk Assessment & Mitigation",
+    "creative": "Creative Exploration & Reframing",
+    "analytical": "Quantitative Decision Matrix",
+    "intuitive": "Gut Check & Alignment Analysis",
+    "visionary": "Strategic Future Mapping",
+    "supportive": "Emotional Alignment & Well-being",
+    "realist": "Weighted Pros/Cons Analysis",
+}
+
+# Message keywords that refine the reasoning label, in priority order;
+# matched as substrings in a single scan of the message
+_REASONING_MODIFIERS = (
+    ("comparative", ("compare", "vs", "versus", "better", "worse"), " - Comparative"),
+    ("financial", ("budget", "cost", "price", "money", "afford"), " - Financial"),
+    ("process", ("step", "process", "how to", "guide"), " - Process-Oriented"),
+)
+_REASONING_PATTERN = re.compile(
+    "|".join(
+        f"(?P<{name}>{'|'.join(map(re.escape, words))})"
+        for name, words, _ in _REASONING_MODIFIERS
+    ),
+    re.IGNORECASE,
+)
+
+
 def determine_reasoning_type(message: str, category: str, advisor_style: str) -> str:
     """Determine the type of reasoning being used based on message, category, and advisor style"""
-    message_lower = message.lower()
-
-    advisor_reasoning = {
-        "optimistic": "Opportunity-Focused Analysis",
-        "skeptical": "Risk Assessment & Mitigation",
-        "creative": "Creative Exploration & Reframing",
-        "analytical": "Quantitative Decision Matrix",
-        "intuitive": "Gut Check & Alignment Analysis",
-        "visionary": "Strategic Future Mapping",
-        "supportive": "Emotional Alignment & Well-being",
-        "realist": "Weighted Pros/Cons Analysis",
-    }
+    base_reasoning = _ADVISOR_REASONING.get(advisor_style, "General Decision Analysis")
 
-    base_reasoning = advisor_reasoning.get(advisor_style, "General Decision Analysis")
-
-    if any(
-        word in message_lower for word in ["compare", "vs", "versus", "better", "worse"]
-    ):
-        return f"{base_reasoning} - Comparative"
-    elif any(
-        word in message_lower for word in ["budget", "cost", "price", "money", "afford"]
-    ):
-        return f"{base_reasoning} - Financial"
-    elif any(word in message_lower for word in ["step", "process", "how to", "guide"]):
-        return f"{base_reasoning} - Process-Oriented"
+    found = {m.lastgroup for m in _REASONING_PATTERN.finditer(message)}
+    for name, _, suffix in _REASONING_MODIFIERS:
+        if name in found:
+            return base_reasoning + suffix
 
     return base_reasoning
 
@@ -1846,8 +2796,9 @@ async def process_decision_step(
                 initial_question=request.message,
                 category=auto_classify_question(request.message),
             )
-            await db.decision_sessions_new.insert_one(session_obj.dict())
-            session = session_obj.dict()
+            session = session_obj.model_dump()
+            # insert_one adds _id to the dict it is given, so pass a copy
+            await db.decision_sessions_new.insert_one(dict(session))
 
         if not session:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Decision session not found")
@@ -1868,7 +2819,7 @@ async def process_decision_step(
                         "step_number": 1,
                         "last_active": datetime.utcnow(),
                     },
-                    "$push": {"followup_questions": followup.dict()},
+                    "$push": {"followup_questions": followup.model_dump()},
                 },
             )
 
@@ -1907,7 +2858,7 @@ async def process_decision_step(
                 await db.decision_sessions_new.update_one(
                     {"id": decision_id},
                     {
-                        "$push": {"followup_questions": followup.dict()},
+                        "$push": {"followup_questions": followup.model_dump()},
                         "$set": {"step_number": step_num + 1},
                     },
                 )
@@ -1932,7 +2883,7 @@ async def process_decision_step(
                     {
                         "$set": {
                             "current_step": "complete",
-                            "recommendation": recommendation.dict(),
+                            "recommendation": recommendation.model_dump(),
                             "completed_at": datetime.utcnow(),
                             "last_active": datetime.utcnow(),
                         }
@@ -1967,7 +2918,8 @@ async def process_decision_step(
             )
 
             await db.decision_sessions_new.update_one(
-                {"id": decision_id}, {"$set": {"recommendation": recommendation.dict()}}
+                {"id": decision_id},
+                {"$set": {"recommendation": recommendation.model_dump()}},
             )
 
             return DecisionStepResponse(
@@ -1982,7 +2934,7 @@ async def process_decision_step(
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error in decision step: {str(e)}")
+        logging.error("Error in decision step: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, f"Error processing request: {str(e)}"
         )
@@ -2006,8 +2958,9 @@ async def process_anonymous_decision_step(request: DecisionStepRequest):
                 initial_question=request.message,
                 category=auto_classify_question(request.message),
             )
-            await db.decision_sessions_new.insert_one(session_obj.dict())
-            session = session_obj.dict()
+            session = session_obj.model_dump()
+            # insert_one adds _id to the dict it is given, so pass a copy
+            await db.decision_sessions_new.insert_one(dict(session))
 
         if not session:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Decision session not found")
@@ -2028,7 +2981,7 @@ async def process_anonymous_decision_step(request: DecisionStepRequest):
                         "step_number": 1,
                         "last_active": datetime.utcnow(),
                     },
-                    "$push": {"followup_questions": followup.dict()},
+                    "$push": {"followup_questions": followup.model_dump()},
                 },
             )
 
@@ -2068,7 +3021,7 @@ async def process_anonymous_decision_step(request: DecisionStepRequest):
                 await db.decision_sessions_new.update_one(
                     {"id": decision_id},
                     {
-                        "$push": {"followup_questions": followup.dict()},
+                        "$push": {"followup_questions": followup.model_dump()},
                         "$set": {"step_number": step_num + 1},
                     },
                 )
@@ -2093,7 +3046,7 @@ async def process_anonymous_decision_step(request: DecisionStepRequest):
                     {
                         "$set": {
                             "current_step": "complete",
-                            "recommendation": recommendation.dict(),
+                            "recommendation": recommendation.model_dump(),
                             "completed_at": datetime.utcnow(),
                             "last_active": datetime.utcnow(),
                         }
@@ -2129,7 +3082,8 @@ async def process_anonymous_decision_step(request: DecisionStepRequest):
             )
 
             await db.decision_sessions_new.update_one(
-                {"id": decision_id}, {"$set": {"recommendation": recommendation.dict()}}
+                {"id": decision_id},
+                {"$set": {"recommendation": recommendation.model_dump()}},
             )
 
             return DecisionStepResponse(
@@ -2144,7 +3098,7 @@ async def process_anonymous_decision_step(request: DecisionStepRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error in anonymous decision step: {str(e)}")
+        logging.error("Error in anonymous decision step: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, f"Error processing request: {str(e)}"
         )
@@ -2245,7 +3199,7 @@ Return only the question, nothing else."""
         )
 
     except Exception as e:
-        logger.error(f"Error generating AI follow-up question: {e}")
+        logger.error("Error generating AI follow-up question: %s", e)
         # Fallback to template questions
         questions_by_category = {
             "consumer": [
@@ -2383,7 +3337,7 @@ CONFIDENCE: 85"""
         )
 
     except Exception as e:
-        logger.error(f"Error generating AI recommendation: {e}")
+        logger.error("Error generating AI recommendation: %s", e)
         # Fallback to template recommendation
         recommendation_text = f"Based on your question about {initial_question.lower()}"
         if answers:
@@ -2403,20 +3357,37 @@ CONFIDENCE: 85"""
 
 
 # Advanced Decision Flow with AI Orchestration
+@functools.lru_cache(maxsize=1)
+def get_ai_orchestrator():
+    """Build the AI orchestrator on first use; None if it can't be imported"""
+    try:
+        from ai_orchestrator_v2 import create_ai_orchestrator
+    except ImportError as e:
+        logger.warning("AI Orchestrator not available: %s", e)
+        return None
+
+    logger.info("AI Orchestrator loaded successfully")
+    # Create orchestrator instance with LLMRouter
+    return create_ai_orchestrator(LLMRouter)
+
+
 @api_router.post("/decision/advanced", response_model=AdvancedDecisionStepResponse)
 async def process_advanced_decision_step(
     request: AdvancedDecisionStepRequest,
     current_user: dict = Depends(get_current_user_optional),
+    ai_orchestrator=Depends(get_ai_orchestrator),
 ):
     """
     Advanced decision processing with multi-LLM orchestration
     Supports structured/intuitive/mixed decision types with consensus logic
     """
-    if not AI_ORCHESTRATOR_AVAILABLE:
+    if ai_orchestrator is None:
         raise HTTPException(
             status_code=503, detail="Advanced AI orchestration not available"
         )
 
+    from ai_orchestrator_v2 import DecisionType
+
     try:
         user_id = current_user.get("id") if current_user else None
         decision_id = request.decision_id or str(uuid.uuid4())
@@ -2487,7 +3458,7 @@ async def process_advanced_decision_step(
                 )
 
             # Store questions as dictionaries for consistent access
-            question_dicts = [q.dict() for q in enhanced_questions]
+            question_dicts = [q.model_dump() for q in enhanced_questions]
 
             # Store ALL questions in session upfront (Hybrid AI-Led approach)
             await db.decision_sessions_advanced.update_one(
@@ -2635,7 +3606,7 @@ Based on their answers, generate 1-2 deeper clarifying or exploratory questions
                             "$set": {
                                 "current_step": "going_deeper",
                                 "deeper_questions": [
-                                    q.dict() for q in enhanced_deeper_questions
+                                    q.model_dump() for q in enhanced_deeper_questions
                                 ],
                                 "last_active": datetime.utcnow(),
                             }
@@ -2653,7 +3624,7 @@ Based on their answers, generate 1-2 deeper clarifying or exploratory questions
                     )
 
             except Exception as e:
-                logging.warning(f"Deeper question generation failed: {e}")
+                logging.warning("Deeper question generation failed: %s", e)
 
             # Fallback to direct recommendation
             return await _generate_advanced_recommendation(
@@ -2701,7 +3672,7 @@ Based on their answers, generate 1-2 deeper clarifying or exploratory questions
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Advanced decision processing error: {str(e)}")
+        logger.error("Advanced decision processing error: %s", e)
         raise HTTPException(
             status_code=500, detail="Error processing advanced decision"
         )
@@ -2716,6 +3687,9 @@ async def _generate_advanced_recommendation(
     """
     Generate advanced recommendation using AI orchestrator
     """
+    from ai_orchestrator_v2 import DecisionType
+
+    ai_orchestrator = get_ai_orchestrator()
     try:
         decision_type = DecisionType(session.get("decision_type", "mixed"))
         initial_question = session.get("initial_question", "")
@@ -2724,7 +3698,7 @@ async def _generate_advanced_recommendation(
         # Get user profile if personalization enabled
         user_profile = None
         if enable_personalization and session.get("user_id"):
-            user = await db.users.find_one({"id": session["user_id"]})
+            user = await load_auth_user(session["user_id"])
             if user:
                 user_profile = {
                     "preferences": user.get("preferences", {}),
@@ -2767,7 +3741,7 @@ async def _generate_advanced_recommendation(
             {"id": decision_id},
             {
                 "$set": {
-                    "recommendation": enhanced_recommendation.dict(),
+                    "recommendation": enhanced_recommendation.model_dump(),
                     "current_step": "complete",
                     "completed_at": datetime.utcnow(),
                     "last_active": datetime.utcnow(),
@@ -2787,7 +3761,7 @@ async def _generate_advanced_recommendation(
         )
 
     except Exception as e:
-        logger.error(f"Advanced recommendation generation error: {str(e)}")
+        logger.error("Advanced recommendation generation error: %s", e)
         raise HTTPException(
             status_code=500, detail="Error generating advanced recommendation"
         )
@@ -2832,7 +3806,7 @@ async def get_decision_versions(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Version retrieval error: {str(e)}")
+        logger.error("Version retrieval error: %s", e)
         raise HTTPException(
             status_code=500, detail="Error retrieving decision versions"
         )
@@ -2923,7 +3897,7 @@ async def compare_decision_versions(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Version comparison error: {str(e)}")
+        logger.error("Version comparison error: %s", e)
         raise HTTPException(status_code=500, detail="Error comparing decision versions")
 
 
@@ -2978,7 +3952,7 @@ async def export_decision(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Export error: {str(e)}")
+        logger.error("Export error: %s", e)
         raise HTTPException(status_code=500, detail="Error exporting decision")
 
 
@@ -3013,7 +3987,7 @@ async def submit_decision_feedback(decision_id: str, request: dict):
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error submitting feedback: {str(e)}")
+        logging.error("Error submitting feedback: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Error submitting feedback"
         )
@@ -3027,20 +4001,16 @@ async def get_user_decisions(
     try:
         decisions = (
             await db.decision_sessions.find(
-                {"user_id": current_user["id"], "is_active": True}
+                {"user_id": current_user["id"], "is_active": True}, {"_id": 0}
             )
             .sort("last_active", -1)
             .limit(limit)
             .to_list(limit)
         )
 
-        for decision in decisions:
-            if "_id" in decision:
-                decision["_id"] = str(decision["_id"])
-
         return {"decisions": decisions}
     except Exception as e:
-        logging.error(f"Error getting decisions: {str(e)}")
+        logging.error("Error getting decisions: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Error retrieving decisions"
         )
@@ -3054,20 +4024,17 @@ async def get_decision_history(
     try:
         conversations = (
             await db.conversations.find(
-                {"decision_id": decision_id, "user_id": current_user["id"]}
+                {"decision_id": decision_id, "user_id": current_user["id"]},
+                {"_id": 0},
             )
             .sort("timestamp", 1)
             .limit(limit)
             .to_list(limit)
         )
 
-        for conv in conversations:
-            if "_id" in conv:
-                conv["_id"] = str(conv["_id"])
-
         return {"conversations": conversations}
     except Exception as e:
-        logging.error(f"Error getting conversation history: {str(e)}")
+        logging.error("Error getting conversation history: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR,
             "Error retrieving conversation history",
@@ -3081,7 +4048,7 @@ async def get_decision_info(
     """Get decision session information"""
     try:
         decision = await db.decision_sessions.find_one(
-            {"decision_id": decision_id, "user_id": current_user["id"]}
+            {"decision_id": decision_id, "user_id": current_user["id"]}, {"_id": 0}
         )
         if not decision:
             return {
@@ -3094,12 +4061,9 @@ async def get_decision_info(
                 "advisor_style": "realist",
             }
 
-        if "_id" in decision:
-            decision["_id"] = str(decision["_id"])
-
         return decision
     except Exception as e:
-        logging.error(f"Error getting decision info: {str(e)}")
+        logging.error("Error getting decision info: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR,
             "Error retrieving decision information",
@@ -3209,15 +4173,13 @@ Generate exactly 3 questions that will give you the best foundation for an excel
             response = await chat.send_message(user_msg)
 
             # Parse JSON response
-            import json
-
             response_clean = response.strip()
             if response_clean.startswith("```json"):
                 response_clean = response_clean[7:-3]
             elif response_clean.startswith("```"):
                 response_clean = response_clean[3:-3]
 
-            followups_data = json.loads(response_clean)
+            followups_data = orjson.loads(response_clean)
 
             # Validate and format questions
             questions = []
@@ -3253,6 +4215,8 @@ Generate exactly 3 questions that will give you the best foundation for an excel
                 )
 
             # Convert to FollowUpQuestion objects for consistency
+            from ai_orchestrator_v2 import FollowUpQuestion
+
             followup_question_objects = []
             for i, q in enumerate(questions):
                 followup_question_objects.append(
@@ -3269,7 +4233,7 @@ Generate exactly 3 questions that will give you the best foundation for an excel
             ]  # Return exactly 3 FollowUpQuestion objects
 
         except Exception as e:
-            logging.warning(f"AI-led followup generation failed: {str(e)}")
+            logging.warning("AI-led followup generation failed: %s", e)
             # Fallback to structured questions
             return SmartFollowupEngine._generate_fallback_questions(classification)
 
@@ -3325,40 +4289,25 @@ Generate exactly 3 questions that will give you the best foundation for an excel
         return base_questions[:2]  # Return max 2 fallback questions
 
 
-def generate_demo_response(
-    message: str,
-    category: str = "general",
-    user_preferences: dict = None,
-    conversation_history: List[dict] = None,
-    advisor_style: str = "realist",
-) -> str:
-    """Generate demo responses when both LLMs fail"""
+# Opening line of the fallback response per advisor style
+_DEMO_INTROS = {
+    "optimistic": "This is a wonderful opportunity to make a positive change! Here's how I see your options with excitement:\n\n",
+    "skeptical": "Let's carefully examine all aspects of this decision to avoid potential pitfalls:\n\n",
+    "creative": "What an interesting challenge! Let me help you explore this from some creative angles:\n\n",
+    "analytical": "Let's break this down systematically with data and logical frameworks:\n\n",
+    "intuitive": "Let's tune into your inner wisdom and see what feels right for you:\n\n",
+    "visionary": "Let's think big picture and consider how this decision shapes your future:\n\n",
+    "supportive": "I understand this decision feels important to you. Let's work through this together:\n\n",
+    "realist": "Let's approach this systematically and consider all the practical factors:\n\n",
+}
+
 
+def _build_demo_response(advisor_style: str) -> str:
+    """Render the fallback response for an advisor style"""
     advisor_config = ADVISOR_STYLES.get(advisor_style, ADVISOR_STYLES["realist"])
 
     response = f"As your getgingee {advisor_config['name']} Advisor, I'm here to help! {advisor_config['motto']}\n\n"
-
-    if advisor_style == "optimistic":
-        response += "This is a wonderful opportunity to make a positive change! Here's how I see your options with excitement:\n\n"
-    elif advisor_style == "skeptical":
-        response += "Let's carefully examine all aspects of this decision to avoid potential pitfalls:\n\n"
-    elif advisor_style == "creative":
-        response += "What an interesting challenge! Let me help you explore this from some creative angles:\n\n"
-    elif advisor_style == "analytical":
-        response += (
-            "Let's break this down systematically with data and logical frameworks:\n\n"
-        )
-    elif advisor_style == "intuitive":
-        response += (
-            "Let's tune into your inner wisdom and see what feels right for you:\n\n"
-        )
-    elif advisor_style == "visionary":
-        response += "Let's think big picture and consider how this decision shapes your future:\n\n"
-    elif advisor_style == "supportive":
-        response += "I understand this decision feels important to you. Let's work through this together:\n\n"
-    else:  # realist
-        response += "Let's approach this systematically and consider all the practical factors:\n\n"
-
+    response += _DEMO_INTROS.get(advisor_style, _DEMO_INTROS["realist"])
     response += f"""**Using My {advisor_config['framework']}:**
 1. **Your values and priorities** - What matters most to you in this situation?
 2. **Key considerations** - {advisor_config['decision_weight']} factors
@@ -3372,6 +4321,59 @@ I suggest taking a structured approach that aligns with your {advisor_style} nee
     return response
 
 
+# The response only depends on the advisor style, so render each one once
+_DEMO_RESPONSES = {style: _build_demo_response(style) for style in ADVISOR_STYLES}
+
+
+def generate_demo_response(
+    message: str,
+    category: str = "general",
+    user_preferences: dict = None,
+    conversation_history: List[dict] = None,
+    advisor_style: str = "realist",
+) -> str:
+    """Generate demo responses when both LLMs fail"""
+    response = _DEMO_RESPONSES.get(advisor_style)
+    if response is None:
+        response = _build_demo_response(advisor_style)
+    return response
+
+
+# Static JSON payloads served with HTTP caching
+STATIC_CACHE_CONTROL = "public, max-age=3600"
+
+
+def build_static_payload(content: dict) -> tuple[bytes, str]:
+    """Encode a static response body once and derive its ETag"""
+    body = orjson.dumps(content)
+    return body, f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def static_json_response(request: Request, payload: tuple[bytes, str]) -> Response:
+    """Serve a prebuilt payload, answering 304 when the client copy is current"""
+    body, etag = payload
+    headers = {"Cache-Control": STATIC_CACHE_CONTROL, "ETag": etag}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match == "*" or etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(body, media_type="application/json", headers=headers)
+
+
+CREDIT_PACKS_PAYLOAD = build_static_payload({"credit_packs": CREDIT_PACKS})
+SUBSCRIPTION_PLANS_PAYLOAD = build_static_payload(
+    {
+        "subscription_plans": SUBSCRIPTION_PLANS,
+        "credit_packs": CREDIT_PACKS,
+        "credit_costs": CREDIT_COSTS,
+    }
+)
+SUBSCRIPTION_PRODUCTS_PAYLOAD = build_static_payload(
+    {"subscription_plans": SUBSCRIPTION_PRODUCTS}
+)
+
+
 # Payment and Billing Endpoints
 @api_router.post("/payments/create-payment-link", response_model=PaymentResponse)
 async def create_payment_link(
@@ -3413,12 +4415,12 @@ async def create_payment_link(
             },
         )
 
-        await db.payments.insert_one(payment_doc.dict())
+        await db.payments.insert_one(payment_doc.model_dump())
 
         return payment_response
 
     except Exception as e:
-        logging.error(f"Error creating payment link: {str(e)}")
+        logging.error("Error creating payment link: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR,
             f"Failed to create payment link: {str(e)}",
@@ -3466,7 +4468,7 @@ async def create_subscription(
             current_period_end=subscription_response.current_period_end,
         )
 
-        await db.subscriptions.insert_one(subscription_doc.dict())
+        await db.subscriptions.insert_one(subscription_doc.model_dump())
 
         # Upgrade user to Pro plan
         await db.users.update_one(
@@ -3478,86 +4480,119 @@ async def create_subscription(
                 }
             },
         )
+        await auth_cache.invalidate(current_user["id"])
 
         return subscription_response
 
     except Exception as e:
-        logging.error(f"Error creating subscription: {str(e)}")
+        logging.error("Error creating subscription: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR,
             f"Failed to create subscription: {str(e)}",
         )
 
 
-@api_router.get("/payments/billing-history")
+def billing_total_stage(statuses: List[str]) -> List[dict]:
+    """Facet stages summing amount over documents in the given statuses"""
+    return [
+        {"$match": {"status": {"$in": statuses}}},
+        {"$group": {"_id": None, "sum": {"$sum": {"$toDouble": "$amount"}}}},
+    ]
+
+
+@api_router.get("/payments/billing-history", response_class=APIJSONResponse)
 async def get_billing_history(current_user: dict = Depends(get_current_user)):
     """Get user's billing history including payments and subscriptions"""
     try:
-        # Get payments
-        payments_cursor = db.payments.find({"user_id": current_user["id"]}).sort(
-            "created_at", -1
+        # Payments and subscriptions are read concurrently, each with its
+        # total computed server-side; subscriptions come back with the newest
+        # active one first, followed by the rest newest first
+        payment_facets, subscription_facets = await asyncio.gather(
+            aggregate_to_list(
+                db.payments,
+                [
+                    {"$match": {"user_id": current_user["id"]}},
+                    {
+                        "$facet": {
+                            "items": [
+                                {"$sort": {"created_at": -1}},
+                                {"$limit": 50},
+                                {"$project": {"_id": 0}},
+                            ],
+                            "total": billing_total_stage(["succeeded"]),
+                        }
+                    },
+                ],
+                1,
+            ),
+            aggregate_to_list(
+                db.subscriptions,
+                [
+                    {"$match": {"user_id": current_user["id"]}},
+                    {
+                        "$facet": {
+                            "items": [
+                                {
+                                    "$addFields": {
+                                        "_priority": {
+                                            "$cond": [
+                                                {"$eq": ["$status", "active"]},
+                                                0,
+                                                1,
+                                            ]
+                                        }
+                                    }
+                                },
+                                {"$sort": {"_priority": 1, "created_at": -1}},
+                                {"$limit": 10},
+                                {"$project": {"_id": 0, "_priority": 0}},
+                            ],
+                            "total": billing_total_stage(["active", "cancelled"]),
+                        }
+                    },
+                ],
+                1,
+            ),
+        )
+        payments = payment_facets[0]["items"]
+        subscriptions = subscription_facets[0]["items"]
+        active_subscription = (
+            subscriptions[0]
+            if subscriptions and subscriptions[0].get("status") == "active"
+            else None
+        )
+        total_spent = sum(
+            facets[0]["total"][0]["sum"]
+            for facets in (payment_facets, subscription_facets)
+            if facets[0]["total"]
         )
-        payments = await payments_cursor.to_list(50)
-
-        # Get subscriptions
-        subscriptions_cursor = db.subscriptions.find(
-            {"user_id": current_user["id"]}
-        ).sort("created_at", -1)
-        subscriptions = await subscriptions_cursor.to_list(10)
-
-        # Find active subscription
-        active_subscription = None
-        for sub in subscriptions:
-            if sub.get("status") == "active":
-                active_subscription = sub
-                break
-
-        # Calculate total spent
-        total_spent = 0
-        for payment in payments:
-            if payment.get("status") == "succeeded":
-                total_spent += float(payment.get("amount", 0))
-
-        for sub in subscriptions:
-            if sub.get("status") in ["active", "cancelled"]:
-                total_spent += float(sub.get("amount", 0))
-
-        # Clean up ObjectIds
-        for payment in payments:
-            if "_id" in payment:
-                payment["_id"] = str(payment["_id"])
-
-        for sub in subscriptions:
-            if "_id" in sub:
-                sub["_id"] = str(sub["_id"])
-
-        if active_subscription and "_id" in active_subscription:
-            active_subscription["_id"] = str(active_subscription["_id"])
 
-        return {
-            "payments": payments,
-            "subscriptions": subscriptions,
-            "active_subscription": active_subscription,
-            "total_spent": total_spent,
-        }
+        return APIJSONResponse(
+            {
+                "payments": payments,
+                "subscriptions": subscriptions,
+                "active_subscription": active_subscription,
+                "total_spent": total_spent,
+            }
+        )
 
     except Exception as e:
-        logging.error(f"Error getting billing history: {str(e)}")
+        logging.error("Error getting billing history: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to retrieve billing history"
         )
 
 
 @api_router.get("/payments/credit-packs")
-async def get_credit_packs():
+async def get_credit_packs(request: Request):
     """Get available credit packs"""
-    return {"credit_packs": CREDIT_PACKS}
+    return static_json_response(request, CREDIT_PACKS_PAYLOAD)
 
 
 @api_router.get("/payments/subscription-plans")
-async def get_subscription_plans():
+async def get_subscription_plans(request: Request):
     """Get available subscription plans"""
-    return {"subscription_plans": SUBSCRIPTION_PRODUCTS}
+    return static_json_response(request, SUBSCRIPTION_PRODUCTS_PAYLOAD)
 
 
 @api_router.post("/payments/cancel-subscription")
@@ -3602,17 +4637,34 @@ async def cancel_subscription(current_user: dict = Depends(get_current_user)):
         await db.users.update_one(
             {"id": current_user["id"]}, {"$set": {"plan": "free"}}
         )
+        await auth_cache.invalidate(current_user["id"])
 
         return {"message": "Subscription cancelled successfully"}
 
     except Exception as e:
-        logging.error(f"Error cancelling subscription: {str(e)}")
+        logging.error("Error cancelling subscription: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR,
             f"Failed to cancel subscription: {str(e)}",
         )
 
 
+def parse_webhook_timestamp(timestamp: str) -> float:
+    """Convert a webhook timestamp header to unix epoch seconds"""
+    try:
+        # Standard Webhooks send integer epoch seconds; int() also rejects
+        # "nan" and "inf", which would slip past the freshness check
+        return float(int(timestamp))
+    except ValueError:
+        pass
+
+    # Fall back to ISO 8601, treating naive values as UTC
+    webhook_time = datetime.fromisoformat(timestamp)
+    if webhook_time.tzinfo is None:
+        webhook_time = webhook_time.replace(tzinfo=timezone.utc)
+    return webhook_time.timestamp()
+
+
 @api_router.post("/webhooks/dodo", include_in_schema=False)
 async def handle_dodo_webhook(request: Request):
     """Handle webhooks from Dodo Payments with enhanced security"""
@@ -3628,32 +4680,32 @@ async def handle_dodo_webhook(request: Request):
                 status.HTTP_401_UNAUTHORIZED, "Missing webhook signature"
             )
 
+        # Verify the signature before doing any work on the untrusted headers
+        if dodo_payments and not await dodo_payments.verify_webhook_signature(
+            body, signature, timestamp
+        ):
+            logger.warning("Webhook signature verification failed")
+            raise HTTPException(
+                status.HTTP_401_UNAUTHORIZED, "Invalid webhook signature"
+            )
+
         # Check timestamp to prevent replay attacks
         try:
-            webhook_time = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
-            time_diff = datetime.utcnow() - webhook_time
-            if time_diff.total_seconds() > 300:  # 5 minutes tolerance
-                raise HTTPException(
-                    status.HTTP_401_UNAUTHORIZED, "Webhook timestamp too old"
-                )
+            webhook_epoch = parse_webhook_timestamp(timestamp)
         except ValueError:
-            logger.warning(f"Invalid webhook timestamp: {timestamp}")
+            logger.warning("Invalid webhook timestamp: %s", timestamp)
             raise HTTPException(
                 status.HTTP_401_UNAUTHORIZED, "Invalid webhook timestamp"
             )
 
-        # Verify webhook signature
-        if dodo_payments and not await dodo_payments.verify_webhook_signature(
-            body, signature, timestamp
-        ):
-            logger.warning("Webhook signature verification failed")
+        if abs(time.time() - webhook_epoch) > WEBHOOK_TOLERANCE_SECONDS:
             raise HTTPException(
-                status.HTTP_401_UNAUTHORIZED, "Invalid webhook signature"
+                status.HTTP_401_UNAUTHORIZED, "Webhook timestamp too old"
             )
 
         try:
-            payload = json.loads(body)
-        except json.JSONDecodeError:
+            payload = orjson.loads(body)
+        except orjson.JSONDecodeError:
             logger.error("Invalid JSON in webhook payload")
             raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid JSON payload")
 
@@ -3661,165 +4713,238 @@ async def handle_dodo_webhook(request: Request):
         data = payload.get("data", {})
 
         # Log webhook received
-        logger.info(f"Verified Dodo webhook received: {event_type}")
-
-        # Process webhook events
-        if event_type == "payment.succeeded":
-            await process_successful_payment(data)
-        elif event_type == "payment.failed":
-            await process_failed_payment(data)
-        elif event_type == "subscription.created":
-            await process_subscription_created(data)
-        elif event_type == "subscription.cancelled":
-            await process_subscription_cancelled(data)
-        elif event_type == "subscription.updated":
-            await process_subscription_updated(data)
+        logger.info("Verified Dodo webhook received: %s", event_type)
+
+        # Record the delivery before processing. It stays pending until its
+        # handler succeeds, so a redelivery after a failure runs it again
+        # while one that was processed is rejected
+        event_id = (
+            request.headers.get("webhook-id")
+            or payload.get("id")
+            or hashlib.sha256(body).hexdigest()
+        )
+        event_key = {"event_id": event_id, "event_type": event_type}
+        try:
+            await db.webhook_events.insert_one(
+                {**event_key, "status": "pending", "received_at": datetime.utcnow()}
+            )
+        except DuplicateKeyError:
+            event = await db.webhook_events.find_one(event_key, {"_id": 0, "status": 1})
+            if not event or event.get("status") != "pending":
+                logger.info("Duplicate webhook ignored: %s %s", event_type, event_id)
+                return {"status": "duplicate", "event_type": event_type}
+            logger.info("Retrying pending webhook: %s %s", event_type, event_id)
+
+        # Process before acknowledging: a failure returns 500 so Dodo retries
+        handler = WEBHOOK_HANDLERS.get(event_type)
+        if handler:
+            await run_webhook_handler(handler, data)
         else:
-            logger.warning(f"Unknown webhook event type: {event_type}")
+            logger.warning("Unknown webhook event type: %s", event_type)
 
+        await db.webhook_events.update_one(event_key, {"$set": {"status": "done"}})
         return {"status": "received", "event_type": event_type}
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error processing webhook: {str(e)}")
+        logger.error("Error processing webhook: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Webhook processing failed"
         )
 
 
+async def run_webhook_handler(handler, data: dict):
+    """Run a webhook processor, limiting how many run at once"""
+    async with webhook_semaphore:
+        await handler(data)
+
+
+# Webhook processors raise on failure so the delivery stays pending and is
+# processed again when Dodo retries; each step is safe to repeat.
 async def process_successful_payment(data: dict):
     """Process successful payment webhook"""
-    try:
-        payment_id = data.get("payment_id") or data.get("id")
-
-        # Find payment record
-        payment = await db.payments.find_one({"dodo_payment_id": payment_id})
-        if not payment:
-            logging.warning(f"Payment not found for Dodo payment ID: {payment_id}")
-            return
+    payment_id = data.get("payment_id") or data.get("id")
+
+    payment = await db.payments.find_one_and_update(
+        {"dodo_payment_id": payment_id},
+        {
+            "$set": {
+                "status": "succeeded",
+                "updated_at": datetime.utcnow(),
+                "payment_method": data.get("payment_method"),
+            }
+        },
+        projection={"_id": 0, "user_id": 1, "credits_amount": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not payment:
+        logging.warning("No payment found for Dodo payment ID: %s", payment_id)
+        return
 
-        # Update payment status
-        await db.payments.update_one(
-            {"id": payment["id"]},
+    # Add credits to user account. The grant and its record are one atomic
+    # update on the user, so a retried delivery can't credit the payment twice
+    if payment.get("credits_amount", 0) > 0:
+        await db.users.update_one(
+            {"id": payment["user_id"], "credited_payments": {"$ne": payment_id}},
             {
-                "$set": {
-                    "status": "succeeded",
-                    "updated_at": datetime.utcnow(),
-                    "payment_method": data.get("payment_method"),
-                }
+                "$inc": {"credits": payment["credits_amount"]},
+                "$push": {"credited_payments": payment_id},
             },
         )
+        await auth_cache.invalidate(payment["user_id"])
 
-        # Add credits to user account
-        if payment.get("credits_amount", 0) > 0:
-            await db.users.update_one(
-                {"id": payment["user_id"]},
-                {"$inc": {"credits": payment["credits_amount"]}},
-            )
-
-        logging.info(f"Payment processed successfully: {payment_id}")
-
-    except Exception as e:
-        logging.error(f"Error processing successful payment: {str(e)}")
+    logging.info("Payment processed successfully: %s", payment_id)
 
 
 async def process_failed_payment(data: dict):
     """Process failed payment webhook"""
-    try:
-        payment_id = data.get("payment_id") or data.get("id")
+    payment_id = data.get("payment_id") or data.get("id")
 
-        await db.payments.update_one(
-            {"dodo_payment_id": payment_id},
-            {"$set": {"status": "failed", "updated_at": datetime.utcnow()}},
-        )
+    # A late or reordered failure must not undo a payment that succeeded
+    await db.payments.update_one(
+        {"dodo_payment_id": payment_id, "status": {"$ne": "succeeded"}},
+        {"$set": {"status": "failed", "updated_at": datetime.utcnow()}},
+    )
 
-        logging.info(f"Payment marked as failed: {payment_id}")
+    logging.info("Payment marked as failed: %s", payment_id)
 
-    except Exception as e:
-        logging.error(f"Error processing failed payment: {str(e)}")
+
+# Subscription webhooks only need the owner back from find_one_and_update
+SUBSCRIPTION_OWNER_PROJECTION = {"_id": 0, "user_id": 1}
 
 
 async def process_subscription_created(data: dict):
     """Process subscription created webhook"""
-    try:
-        subscription_id = data.get("subscription_id") or data.get("id")
-
-        # Find subscription record
-        subscription = await db.subscriptions.find_one(
-            {"dodo_subscription_id": subscription_id}
-        )
-        if not subscription:
-            logging.warning(
-                f"Subscription not found for Dodo subscription ID: {subscription_id}"
-            )
-            return
-
-        # Upgrade user to Pro plan
-        await db.users.update_one(
-            {"id": subscription["user_id"]}, {"$set": {"plan": "pro"}}
-        )
-
-        await db.subscriptions.update_one(
-            {"id": subscription["id"]},
-            {"$set": {"status": "active", "updated_at": datetime.utcnow()}},
+    subscription_id = data.get("subscription_id") or data.get("id")
+
+    # Activate the subscription and fetch its owner in one round-trip
+    subscription = await db.subscriptions.find_one_and_update(
+        # A retried creation must not revive a subscription cancelled since
+        {"dodo_subscription_id": subscription_id, "status": {"$ne": "cancelled"}},
+        {"$set": {"status": "active", "updated_at": datetime.utcnow()}},
+        projection=SUBSCRIPTION_OWNER_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    if not subscription:
+        logging.warning(
+            "No open subscription found for Dodo subscription ID: %s",
+            subscription_id,
         )
+        return
 
-        logging.info(f"Subscription activated: {subscription_id}")
+    # Upgrade user to Pro plan
+    await db.users.update_one(
+        {"id": subscription["user_id"]}, {"$set": {"plan": "pro"}}
+    )
+    await auth_cache.invalidate(subscription["user_id"])
 
-    except Exception as e:
-        logging.error(f"Error processing subscription created: {str(e)}")
+    logging.info("Subscription activated: %s", subscription_id)
 
 
 async def process_subscription_cancelled(data: dict):
     """Process subscription cancelled webhook"""
-    try:
-        subscription_id = data.get("subscription_id") or data.get("id")
+    subscription_id = data.get("subscription_id") or data.get("id")
 
-        # Update subscription status
-        await db.subscriptions.update_one(
-            {"dodo_subscription_id": subscription_id},
+    # Cancel the subscription and fetch its owner in one round-trip; a retry
+    # keeps the original cancellation time
+    now = datetime.utcnow()
+    subscription = await db.subscriptions.find_one_and_update(
+        {"dodo_subscription_id": subscription_id},
+        [
             {
                 "$set": {
                     "status": "cancelled",
-                    "cancelled_at": datetime.utcnow(),
-                    "updated_at": datetime.utcnow(),
+                    "cancelled_at": {"$ifNull": ["$cancelled_at", now]},
+                    "updated_at": now,
                 }
-            },
-        )
+            }
+        ],
+        projection=SUBSCRIPTION_OWNER_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
 
-        # Find user and downgrade to free plan
-        subscription = await db.subscriptions.find_one(
-            {"dodo_subscription_id": subscription_id}
+    # Downgrade to free plan
+    if subscription:
+        await db.users.update_one(
+            {"id": subscription["user_id"]}, {"$set": {"plan": "free"}}
         )
-        if subscription:
-            await db.users.update_one(
-                {"id": subscription["user_id"]}, {"$set": {"plan": "free"}}
-            )
+        await auth_cache.invalidate(subscription["user_id"])
 
-        logging.info(f"Subscription cancelled: {subscription_id}")
+    logging.info("Subscription cancelled: %s", subscription_id)
 
-    except Exception as e:
-        logging.error(f"Error processing subscription cancelled: {str(e)}")
+
+# Last updated_at touch per subscription (most recent last), used to skip
+# repeated heartbeats
+SUBSCRIPTION_TOUCH_INTERVAL_SECONDS = 60
+SUBSCRIPTION_TOUCH_CACHE_SIZE = 10000
+recent_subscription_touches: "OrderedDict[str, float]" = OrderedDict()
 
 
 async def process_subscription_updated(data: dict):
     """Process subscription updated webhook"""
-    try:
-        subscription_id = data.get("subscription_id") or data.get("id")
+    subscription_id = data.get("subscription_id") or data.get("id")
 
-        await db.subscriptions.update_one(
+    now = time.monotonic()
+    last_touch = recent_subscription_touches.get(subscription_id)
+    if (
+        last_touch is not None
+        and now - last_touch < SUBSCRIPTION_TOUCH_INTERVAL_SECONDS
+    ):
+        logging.info("Subscription updated (recently touched): %s", subscription_id)
+        return
+    recent_subscription_touches[subscription_id] = now
+    recent_subscription_touches.move_to_end(subscription_id)
+    if len(recent_subscription_touches) > SUBSCRIPTION_TOUCH_CACHE_SIZE:
+        recent_subscription_touches.popitem(last=False)
+
+    # $max keeps the batched touches order-independent
+    await event_writer.write(
+        "subscriptions",
+        UpdateOne(
             {"dodo_subscription_id": subscription_id},
-            {"$set": {"updated_at": datetime.utcnow()}},
-        )
+            {"$max": {"updated_at": datetime.utcnow()}},
+        ),
+    )
 
-        logging.info(f"Subscription updated: {subscription_id}")
+    logging.info("Subscription updated: %s", subscription_id)
 
-    except Exception as e:
-        logging.error(f"Error processing subscription updated: {str(e)}")
+
+# Webhook event type -> processor
+WEBHOOK_HANDLERS = {
+    "payment.succeeded": process_successful_payment,
+    "payment.failed": process_failed_payment,
+    "subscription.created": process_subscription_created,
+    "subscription.cancelled": process_subscription_cancelled,
+    "subscription.updated": process_subscription_updated,
+}
 
 
 # Decision Export & Sharing Endpoints
+# Fields the PDF exporter actually reads
+PDF_DECISION_PROJECTION = {
+    "_id": 0,
+    "decision_id": 1,
+    "user_id": 1,
+    "title": 1,
+    "category": 1,
+    "advisor_style": 1,
+    "llm_preference": 1,
+    "message_count": 1,
+    "total_credits_used": 1,
+    "created_at": 1,
+    "last_active": 1,
+}
+PDF_CONVERSATION_PROJECTION = {
+    "_id": 0,
+    "user_message": 1,
+    "ai_response": 1,
+    "llm_used": 1,
+    "advisor_style": 1,
+    "credits_used": 1,
+}
+
+
 @api_router.post("/decisions/{decision_id}/export-pdf")
 async def export_decision_pdf(
     decision_id: str, current_user: dict = Depends(get_current_user)
@@ -3832,44 +4957,38 @@ async def export_decision_pdf(
                 status.HTTP_403_FORBIDDEN, "PDF export requires Pro subscription"
             )
 
-        # Get decision data
-        decision = await db.decision_sessions.find_one(
-            {"decision_id": decision_id, "user_id": current_user["id"]}
+        # Load the decision and its conversation history together
+        decision_filter = {"decision_id": decision_id, "user_id": current_user["id"]}
+        decision, conversations = await asyncio.gather(
+            db.decision_sessions.find_one(decision_filter, PDF_DECISION_PROJECTION),
+            db.conversations.find(decision_filter, PDF_CONVERSATION_PROJECTION)
+            .sort("timestamp", 1)
+            .to_list(100),
         )
 
         if not decision:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Decision not found")
 
-        # Get conversation history
-        conversations = (
-            await db.conversations.find(
-                {"decision_id": decision_id, "user_id": current_user["id"]}
-            )
-            .sort("timestamp", 1)
-            .to_list(100)
-        )
-
         # Generate PDF
-        pdf_data = await pdf_exporter.export_decision_to_pdf(
-            decision_data=decision, conversations=conversations, user_info=current_user
+        pdf_chunks = await pdf_exporter.stream_decision_to_pdf(
+            decision_data=decision,
+            conversations=conversations,
+            user_info={"email": current_user.get("email")},
         )
 
         # Create response with PDF
-        from fastapi.responses import StreamingResponse
-
-        def generate_pdf():
-            yield pdf_data
-
         filename = f"decision-{decision_id[:8]}-{datetime.now().strftime('%Y%m%d')}.pdf"
 
         return StreamingResponse(
-            io.BytesIO(pdf_data),
+            pdf_chunks,
             media_type="application/pdf",
             headers={"Content-Disposition": f"attachment; filename={filename}"},
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error exporting PDF: {str(e)}")
+        logging.error("Error exporting PDF: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, f"Failed to export PDF: {str(e)}"
         )
@@ -3905,7 +5024,7 @@ async def create_decision_share(
         return share_data
 
     except Exception as e:
-        logging.error(f"Error creating share: {str(e)}")
+        logging.error("Error creating share: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, f"Failed to create share: {str(e)}"
         )
@@ -3925,7 +5044,7 @@ async def get_shared_decision(share_id: str):
         return shared_data
 
     except Exception as e:
-        logging.error(f"Error getting shared decision: {str(e)}")
+        logging.error("Error getting shared decision: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to retrieve shared decision"
         )
@@ -3945,7 +5064,7 @@ async def revoke_decision_share(
         return {"message": "Share revoked successfully"}
 
     except Exception as e:
-        logging.error(f"Error revoking share: {str(e)}")
+        logging.error("Error revoking share: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to revoke share"
         )
@@ -3976,7 +5095,7 @@ async def compare_decisions(
         return comparison_data
 
     except Exception as e:
-        logging.error(f"Error comparing decisions: {str(e)}")
+        logging.error("Error comparing decisions: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR,
             f"Failed to compare decisions: {str(e)}",
@@ -3994,55 +5113,106 @@ async def get_decision_shares(
                 "decision_id": decision_id,
                 "user_id": current_user["id"],
                 "is_active": True,
-            }
+            },
+            {"_id": 0},
         ).to_list(10)
 
-        # Clean up shares data
-        for share in shares:
-            if "_id" in share:
-                share["_id"] = str(share["_id"])
-
         return {"shares": shares}
 
     except Exception as e:
-        logging.error(f"Error getting decision shares: {str(e)}")
+        logging.error("Error getting decision shares: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to retrieve shares"
         )
 
 
 # Account Security & Privacy Endpoints (Simplified)
+# Profile fields included in a data export; secrets and tokens stay out
+USER_EXPORT_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "name": 1,
+    "email": 1,
+    "plan": 1,
+    "credits": 1,
+    "monthly_decisions_used": 1,
+    "subscription_expires": 1,
+    "email_verified": 1,
+    "email_verified_at": 1,
+    "privacy_settings": 1,
+    "last_login": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "is_active": 1,
+}
+
+
+# Documents per cursor batch, so an export holds at most one batch in memory
+EXPORT_BATCH_SIZE = 200
+
+
+async def iter_user_documents(collection, user_id: str):
+    """Yield a user's documents from a collection one cursor batch at a time"""
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$sort": {"_id": 1}},
+        {"$addFields": {"_id": {"$toString": "$_id"}}},
+    ]
+    async for doc in await collection.aggregate(pipeline, batchSize=EXPORT_BATCH_SIZE):
+        yield doc
+
+
+async def stream_user_documents(collection, user_id: str, record_type: str):
+    """Yield a user's documents from a collection as NDJSON lines"""
+    async for doc in iter_user_documents(collection, user_id):
+        yield orjson.dumps({"type": record_type, "data": doc}, default=str) + b"\n"
+
+
+async def stream_json_array(collection, user_id: str):
+    """Yield a user's documents from a collection as JSON array items"""
+    separator = b""
+    async for doc in iter_user_documents(collection, user_id):
+        yield separator + orjson.dumps(doc, default=orjson_default)
+        separator = b","
+
+
 @api_router.post("/account/export-data")
 async def export_user_data(current_user: dict = Depends(get_current_user)):
-    """Export all user data for GDPR compliance (simplified)"""
-    try:
-        user = await db.users.find_one({"id": current_user["id"]})
-        decisions = await db.decision_sessions.find(
-            {"user_id": current_user["id"]}
-        ).to_list(None)
-        conversations = await db.conversations.find(
-            {"user_id": current_user["id"]}
-        ).to_list(None)
-
-        # Remove sensitive data
-        if user and "_id" in user:
-            user["_id"] = str(user["_id"])
-        for d in decisions:
-            if "_id" in d:
-                d["_id"] = str(d["_id"])
-        for c in conversations:
-            if "_id" in c:
-                c["_id"] = str(c["_id"])
+    """Export all user data for GDPR compliance as NDJSON (simplified)"""
+    user_id = current_user["id"]
 
-        return {
-            "user_profile": user,
-            "decisions": decisions,
-            "conversations": conversations,
-            "export_date": datetime.utcnow().isoformat(),
-        }
-    except Exception as e:
-        logging.error(f"Error exporting user data: {str(e)}")
-        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Data export failed")
+    async def generate_export():
+        try:
+            yield orjson.dumps(
+                {"type": "export", "export_date": datetime.utcnow().isoformat()}
+            ) + b"\n"
+
+            user = await db.users.find_one({"id": user_id}, USER_EXPORT_PROJECTION)
+            yield orjson.dumps(
+                {"type": "user_profile", "data": user}, default=str
+            ) + b"\n"
+
+            async for line in stream_user_documents(
+                db.decision_sessions, user_id, "decision"
+            ):
+                yield line
+            async for line in stream_user_documents(
+                db.conversations, user_id, "conversation"
+            ):
+                yield line
+        except Exception as e:
+            logging.error("Error exporting user data: %s", e)
+            yield orjson.dumps(
+                {"type": "error", "detail": "Data export failed"}
+            ) + b"\n"
+
+    return StreamingResponse(
+        generate_export(),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f"attachment; filename=choicepilot-export-{user_id[:8]}.ndjson"
+        },
+    )
 
 
 @api_router.post("/account/delete")
@@ -4057,7 +5227,10 @@ async def delete_account(current_user: dict = Depends(get_current_user)):
 async def get_privacy_settings(current_user: dict = Depends(get_current_user)):
     """Get user privacy settings"""
     try:
-        user = await db.users.find_one({"id": current_user["id"]})
+        # The auth cache leaves privacy settings out, so read just those
+        user = await db.users.find_one(
+            {"id": current_user["id"]}, {"_id": 0, "privacy_settings": 1}
+        )
         if not user:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
 
@@ -4071,8 +5244,10 @@ async def get_privacy_settings(current_user: dict = Depends(get_current_user)):
                 "security_notifications", True
             ),
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error getting privacy settings: {str(e)}")
+        logging.error("Error getting privacy settings: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to get privacy settings"
         )
@@ -4088,56 +5263,54 @@ async def update_privacy_settings(
             {"id": current_user["id"]},
             {
                 "$set": {
-                    "privacy_settings": settings.dict(),
+                    "privacy_settings": settings.model_dump(),
                     "updated_at": datetime.utcnow(),
                 }
             },
         )
+        await auth_cache.invalidate(current_user["id"])
 
         return {"message": "Privacy settings updated successfully"}
     except Exception as e:
-        logging.error(f"Error updating privacy settings: {str(e)}")
+        logging.error("Error updating privacy settings: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to update privacy settings"
         )
 
 
-@api_router.get("/account/security-log")
+SECURITY_LOG_PROJECTION = {"_id": 0, "requester_ip": 0, "deletion_results": 0}
+MAX_SECURITY_LOG_ENTRIES = 100
+
+
+@api_router.get("/account/security-log", response_class=APIJSONResponse)
 async def get_security_log(
     current_user: dict = Depends(get_current_user), limit: int = 20
 ):
     """Get user's security activity log"""
+    limit = max(1, min(limit, MAX_SECURITY_LOG_ENTRIES))
     try:
-        # Get recent security events for this user
+        # Get recent security events for this user, leaving sensitive fields
+        # (and the bulky deletion results) on the server
         security_events = (
-            await db.audit_logs.find({"user_id": current_user["id"]})
+            await db.audit_logs.find(
+                {"user_id": current_user["id"]}, SECURITY_LOG_PROJECTION
+            )
             .sort("timestamp", -1)
             .limit(limit)
             .to_list(limit)
         )
 
-        # Clean sensitive data
-        for event in security_events:
-            if "_id" in event:
-                event["_id"] = str(event["_id"])
-
-            # Remove sensitive fields but keep relevant security info
-            event.pop("requester_ip", None)
-            event.pop("deletion_results", None)
-
-        return {"security_events": security_events}
+        return APIJSONResponse({"security_events": security_events})
     except Exception as e:
-        logging.error(f"Error getting security log: {str(e)}")
+        logging.error("Error getting security log: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to get security log"
         )
 
 
 # Privacy Policy and Terms Endpoints
-@api_router.get("/legal/privacy-policy")
-async def get_privacy_policy():
-    """Get privacy policy"""
-    return {
+PRIVACY_POLICY_PAYLOAD = build_static_payload(
+    {
         "privacy_policy": {
             "last_updated": "2025-01-15",
             "version": "1.0",
@@ -4152,12 +5325,10 @@ async def get_privacy_policy():
             },
         }
     }
+)
 
-
-@api_router.get("/legal/terms-of-service")
-async def get_terms_of_service():
-    """Get terms of service"""
-    return {
+TERMS_OF_SERVICE_PAYLOAD = build_static_payload(
+    {
         "terms_of_service": {
             "last_updated": "2025-01-15",
             "version": "1.0",
@@ -4173,6 +5344,19 @@ async def get_terms_of_service():
             },
         }
     }
+)
+
+
+@api_router.get("/legal/privacy-policy")
+async def get_privacy_policy(request: Request):
+    """Get privacy policy"""
+    return static_json_response(request, PRIVACY_POLICY_PAYLOAD)
+
+
+@api_router.get("/legal/terms-of-service")
+async def get_terms_of_service(request: Request):
+    """Get terms of service"""
+    return static_json_response(request, TERMS_OF_SERVICE_PAYLOAD)
 
 
 # Security & Monitoring Endpoints
@@ -4190,65 +5374,69 @@ async def get_security_events(
     # TODO: Add admin role check
     try:
         events = (
-            await db.security_events.find()
+            await db.security_events.find({}, {"_id": 0})
             .sort("timestamp", -1)
             .limit(limit)
             .to_list(limit)
         )
 
-        # Clean up ObjectIds
-        for event in events:
-            if "_id" in event:
-                event["_id"] = str(event["_id"])
-
         return {"security_events": events}
     except Exception as e:
-        logger.error(f"Error getting security events: {str(e)}")
+        logger.error("Error getting security events: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to retrieve security events"
         )
 
 
-@api_router.get("/admin/performance-metrics")
+@api_router.get("/admin/performance-metrics", response_class=APIJSONResponse)
 async def get_performance_metrics(hours: int = 24):
     """Get performance metrics for the last N hours"""
     try:
         since = datetime.utcnow() - timedelta(hours=hours)
 
-        # Get metrics from database
-        metrics = (
-            await db.performance_metrics.find({"timestamp": {"$gte": since}})
+        # Summarise the window in Mongo; the recent metrics come straight off
+        # the timestamp index, which a $facet sub-pipeline couldn't use
+        window = {"timestamp": {"$gte": since}}
+        stats_pipeline = [
+            {"$match": window},
+            {
+                "$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "avg_time": {"$avg": "$response_time"},
+                    "max_time": {"$max": "$response_time"},
+                    "errors": {"$sum": {"$cond": ["$is_error", 1, 0]}},
+                }
+            },
+        ]
+        summary, metrics = await asyncio.gather(
+            aggregate_to_list(db.performance_metrics, stats_pipeline, 1),
+            db.performance_metrics.find(window, {"_id": 0})
             .sort("timestamp", -1)
-            .limit(1000)
-            .to_list(1000)
+            .limit(100)
+            .to_list(100),
         )
+        stats = summary[0] if summary else {}
 
-        # Calculate summary statistics
-        if metrics:
-            response_times = [m["response_time"] for m in metrics]
-            avg_response_time = sum(response_times) / len(response_times)
-            max_response_time = max(response_times)
-            error_count = sum(1 for m in metrics if m.get("is_error"))
-            error_rate = error_count / len(metrics) if metrics else 0
-        else:
-            avg_response_time = max_response_time = error_rate = 0
-
-        # Clean up ObjectIds
-        for metric in metrics:
-            if "_id" in metric:
-                metric["_id"] = str(metric["_id"])
+        total_requests = stats.get("total", 0)
+        avg_response_time = stats.get("avg_time") or 0
+        max_response_time = stats.get("max_time") or 0
+        error_count = stats.get("errors", 0)
+        error_rate = error_count / total_requests if total_requests else 0
 
-        return {
-            "period_hours": hours,
-            "total_requests": len(metrics),
-            "avg_response_time": round(avg_response_time, 3),
-            "max_response_time": round(max_response_time, 3),
-            "error_rate": round(error_rate, 4),
-            "error_count": error_count,
-            "metrics": metrics[:100],  # Return only recent 100 for display
-        }
+        return APIJSONResponse(
+            {
+                "period_hours": hours,
+                "total_requests": total_requests,
+                "avg_response_time": round(avg_response_time, 3),
+                "max_response_time": round(max_response_time, 3),
+                "error_rate": round(error_rate, 4),
+                "error_count": error_count,
+                "metrics": metrics,  # Only the most recent 100 for display
+            }
+        )
     except Exception as e:
-        logger.error(f"Error getting performance metrics: {str(e)}")
+        logger.error("Error getting performance metrics: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR,
             "Failed to retrieve performance metrics",
@@ -4276,91 +5464,322 @@ async def generate_audit_report(start_date: str, end_date: str):
             "Invalid date format. Use ISO format: YYYY-MM-DD",
         )
     except Exception as e:
-        logger.error(f"Error generating audit report: {str(e)}")
+        logger.error("Error generating audit report: %s", e)
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to generate audit report"
         )
 
 
 # Legacy endpoints for compatibility
-@api_router.get("/")
-async def root():
-    return {
+ROOT_BODY = orjson.dumps(
+    {
         "message": "ChoicePilot API - Your Personal AI Decision Assistant with Smart Monetization"
     }
+)
+
+
+@api_router.get("/")
+async def root():
+    return Response(content=ROOT_BODY, media_type="application/json")
 
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# CORS policy, resolved once at import. CORS_ORIGINS is a comma-separated
+# allow-list; without it only FRONTEND_URL is allowed, and "*" is the
+# development fallback when neither is set.
+CORS_ORIGINS = frozenset(
+    origin.strip().rstrip("/")
+    for origin in os.environ.get("CORS_ORIGINS", FRONTEND_URL or "*").split(",")
+    if origin.strip()
+)
+CORS_ALLOW_METHODS = ("GET", "POST", "PUT", "DELETE", "OPTIONS")
+CORS_ALLOW_HEADERS = (
+    "Authorization",
+    "Content-Type",
+    "X-Requested-With",
+    "Accept",
+    "Origin",
+)
+CORS_EXPOSE_HEADERS = ("Content-Disposition",)
+CORS_MAX_AGE = 86400  # Let browsers cache preflight responses for a day
+
 # Add secure CORS middleware
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins for testing
+    FastPathCORSMiddleware,
+    allow_origins=sorted(CORS_ORIGINS),
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=[
-        "Authorization",
-        "Content-Type",
-        "X-Requested-With",
-        "Accept",
-        "Origin",
-        "Access-Control-Request-Method",
-        "Access-Control-Request-Headers",
-    ],
-    expose_headers=["Content-Disposition"],
+    allow_methods=CORS_ALLOW_METHODS,
+    allow_headers=CORS_ALLOW_HEADERS,
+    expose_headers=CORS_EXPOSE_HEADERS,
+    max_age=CORS_MAX_AGE,
 )
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger(__name__)
 
-# Add current directory to path for local imports
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# Import AI Orchestrator after logger is defined
-try:
-    from ai_orchestrator_v2 import (
-        create_ai_orchestrator,
-        DecisionType,
-        FollowUpQuestion,
-        DecisionRecommendation,
-        DecisionTrace,
-    )
+async def configure_logging():
+    """Install the default log handler unless one is already configured"""
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        )
 
-    AI_ORCHESTRATOR_AVAILABLE = True
-    logger.info("AI Orchestrator loaded successfully")
-    # Create orchestrator instance with LLMRouter
-    ai_orchestrator = create_ai_orchestrator(LLMRouter)
-except ImportError as e:
-    logger.warning(f"AI Orchestrator not available: {e}")
-    AI_ORCHESTRATOR_AVAILABLE = False
-    ai_orchestrator = None
 
+# Build the AI orchestrator at import time when asked to (e.g. in CI)
+if os.environ.get("CHOICEPILOT_EAGER_IMPORT") == "1":
+    get_ai_orchestrator()
 
-@api_router.get("/debug/ai-orchestrator")
-async def debug_ai_orchestrator():
-    """Debug endpoint to check AI orchestrator status"""
-    return {
-        "ai_orchestrator_available": AI_ORCHESTRATOR_AVAILABLE,
+
+def __getattr__(name):
+    """Resolve the orchestrator globals lazily for external importers"""
+    if name == "ai_orchestrator":
+        return get_ai_orchestrator()
+    if name == "AI_ORCHESTRATOR_AVAILABLE":
+        return get_ai_orchestrator() is not None
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Debug status is served from this cache and refreshed in the background once
+# stale, so polling never waits on the orchestrator
+AI_ORCHESTRATOR_DEBUG_TTL_SECONDS = 30
+ai_orchestrator_debug_cache = {"body": None, "ts": 0.0, "refresh_task": None}
+
+
+def build_ai_orchestrator_debug_body() -> bytes:
+    """Describe the orchestrator as a serialized status payload"""
+    ai_orchestrator = get_ai_orchestrator()
+    payload = {
+        "ai_orchestrator_available": ai_orchestrator is not None,
         "ai_orchestrator_type": str(type(ai_orchestrator)),
-        "llm_router_available": hasattr(ai_orchestrator, "llm_router")
-        if ai_orchestrator
-        else False,
-        "classifier_available": hasattr(ai_orchestrator, "classifier")
-        if ai_orchestrator
-        else False,
-        "smart_router_available": hasattr(ai_orchestrator, "smart_router")
-        if ai_orchestrator
-        else False,
-        "followup_engine_available": hasattr(ai_orchestrator, "followup_engine")
-        if ai_orchestrator
-        else False,
+        "llm_router_available": False,
+        "classifier_available": False,
+        "smart_router_available": False,
+        "followup_engine_available": False,
     }
+    if ai_orchestrator:
+        payload.update(ai_orchestrator.component_status)
+    return orjson.dumps(payload)
+
+
+async def refresh_ai_orchestrator_debug_cache():
+    """Rebuild the cached debug body off the event loop"""
+    body = await asyncio.to_thread(build_ai_orchestrator_debug_body)
+    ai_orchestrator_debug_cache["body"] = body
+    ai_orchestrator_debug_cache["ts"] = time.monotonic()
+
+
+async def debug_ai_orchestrator():
+    """Debug endpoint to check AI orchestrator status"""
+    cache = ai_orchestrator_debug_cache
+    if cache["body"] is None:
+        await refresh_ai_orchestrator_debug_cache()
+    elif time.monotonic() - cache["ts"] >= AI_ORCHESTRATOR_DEBUG_TTL_SECONDS and (
+        cache["refresh_task"] is None or cache["refresh_task"].done()
+    ):
+        # Serve the stale copy now; the next caller gets the refreshed one
+        cache["refresh_task"] = asyncio.create_task(
+            refresh_ai_orchestrator_debug_cache()
+        )
+    return Response(content=cache["body"], media_type="application/json")
+
+
+# api_router has already been included above, so the debug route goes on the
+# app directly, and only when explicitly enabled
+if os.environ.get("CHOICEPILOT_DEBUG") == "1":
+    app.add_api_route(
+        "/api/debug/ai-orchestrator", debug_ai_orchestrator, methods=["GET"]
+    )
+
+
+async def migrate_user_dates():
+    """Convert user dates stored as ISO strings by older versions to BSON dates"""
+    for field in ("last_reset", "subscription_expires"):
+        # Strings that do not parse are left as they are rather than failing
+        # the whole update
+        convert = {"input": f"${field}", "to": "date", "onError": f"${field}"}
+        result = await db.users.update_many(
+            {field: {"$type": "string"}},
+            [{"$set": {field: {"$convert": convert}}}],
+        )
+        if result.modified_count:
+            logger.info(
+                "Converted %s on %d users to dates", field, result.modified_count
+            )
+        unparsed = await db.users.count_documents({field: {"$type": "string"}})
+        if unparsed:
+            logger.warning(
+                "%d users have a %s string that is not a date", unparsed, field
+            )
+
+
+async def merge_duplicate_decision_sessions():
+    """Fold sessions duplicated by concurrent first turns into the oldest one"""
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        {
+            "$group": {
+                "_id": {"decision_id": "$decision_id", "user_id": "$user_id"},
+                "ids": {"$push": "$_id"},
+                "message_count": {"$sum": "$message_count"},
+                "total_credits_used": {"$sum": "$total_credits_used"},
+                "last_active": {"$max": "$last_active"},
+            }
+        },
+        {"$match": {"ids.1": {"$exists": True}}},
+    ]
+    merged = 0
+    async for group in await db.decision_sessions.aggregate(
+        pipeline, allowDiskUse=True
+    ):
+        keep, *duplicates = group["ids"]
+        await db.decision_sessions.update_one(
+            {"_id": keep},
+            {
+                "$set": {
+                    "message_count": group["message_count"],
+                    "total_credits_used": group["total_credits_used"],
+                    "last_active": group["last_active"],
+                }
+            },
+        )
+        await db.decision_sessions.delete_many({"_id": {"$in": duplicates}})
+        merged += len(duplicates)
+    if merged:
+        logger.info("Merged %d duplicate decision sessions", merged)
+
+
+async def ensure_unique_decision_sessions():
+    """Make (decision_id, user_id) unique, merging duplicates first if needed
+
+    The /chat session upsert relies on this index to stay one session per
+    decision. Older startups fell back to a non-unique index of the same name,
+    which has to be dropped before the unique one can be built.
+    """
+    indexes = await db.decision_sessions.index_information()
+    existing = indexes.get("decision_id_1_user_id_1")
+    if existing and existing.get("unique"):
+        return
+    await merge_duplicate_decision_sessions()
+    if existing:
+        await db.decision_sessions.drop_index("decision_id_1_user_id_1")
+    await db.decision_sessions.create_index(
+        [("decision_id", 1), ("user_id", 1)], unique=True
+    )
+
+
+async def ensure_unique_user_index(field: str):
+    """Make a users field unique, or report duplicates and index it anyway
+
+    Accounts sharing an id or email cannot be merged automatically, so until
+    someone resolves them startup keeps a non-unique index of the same name
+    instead of aborting.
+    """
+    name = f"{field}_1"
+    indexes = await db.users.index_information()
+    existing = indexes.get(name)
+    if existing and existing.get("unique"):
+        return
+    pipeline = [
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    duplicates = await aggregate_to_list(db.users, pipeline, 20)
+    if not duplicates:
+        if existing:
+            await db.users.drop_index(name)
+        try:
+            await db.users.create_index(field, unique=True)
+            return
+        except DuplicateKeyError:
+            # A duplicate was written between the check and the build
+            existing = None
+    logger.error(
+        "Users share a %s, so it is not unique-indexed until resolved: %s",
+        field,
+        [duplicate["_id"] for duplicate in duplicates],
+    )
+    if not existing:
+        await db.users.create_index(field)
+
+
+async def create_indexes():
+    """Ensure the indexes the request handlers rely on exist"""
+    await db.webhook_events.create_index(
+        [("event_id", 1), ("event_type", 1)], unique=True
+    )
+    await db.webhook_events.create_index(
+        "received_at", expireAfterSeconds=WEBHOOK_EVENT_TTL_SECONDS
+    )
+    await db.decision_sessions.create_index([("user_id", 1), ("_id", 1)])
+    # Decision list, and the per-turn session upsert in /chat
+    await db.decision_sessions.create_index(
+        [("user_id", 1), ("is_active", 1), ("last_active", -1)]
+    )
+    await ensure_unique_decision_sessions()
+    # The step-by-step flow reads its sessions by id
+    await db.decision_sessions_new.create_index("id", unique=True)
+    await db.conversations.create_index([("user_id", 1), ("_id", 1)])
+    await db.performance_metrics.create_index([("timestamp", -1)])
+
+    # Every authenticated request looks its user up by id; login, registration
+    # and password resets look it up by email
+    await ensure_unique_user_index("id")
+    await ensure_unique_user_index("email")
+    await db.password_resets.create_index([("email", 1), ("reset_token", 1)])
+    # Reset tokens are removed by Mongo once they expire
+    await db.password_resets.create_index("expires_at", expireAfterSeconds=0)
+
+    # Billing lookups; provider ids are only set once Dodo assigns them
+    await db.payments.create_index([("user_id", 1), ("created_at", -1)])
+    await db.payments.create_index(
+        "dodo_payment_id",
+        unique=True,
+        partialFilterExpression={"dodo_payment_id": {"$type": "string"}},
+    )
+    await db.subscriptions.create_index([("user_id", 1), ("status", 1)])
+    await db.subscriptions.create_index([("user_id", 1), ("created_at", -1)])
+    await db.subscriptions.create_index(
+        "dodo_subscription_id",
+        unique=True,
+        partialFilterExpression={"dodo_subscription_id": {"$type": "string"}},
+    )
+
+    # Account, admin and sharing reads
+    await db.audit_logs.create_index([("user_id", 1), ("timestamp", -1)])
+    await db.security_events.create_index([("timestamp", -1)])
+    await db.decision_shares.create_index(
+        [("decision_id", 1), ("user_id", 1), ("is_active", 1)]
+    )
+    await db.conversations.create_index(
+        [("decision_id", 1), ("user_id", 1), ("timestamp", 1)]
+    )
+
+
+async def start_event_writer():
+    """Batch audit, metric and webhook bookkeeping writes in the background"""
+    event_writer.start()
+
+
+async def start_pdf_pool():
+    """Render PDFs in worker processes so exports don't stall the event loop"""
+    # spawn keeps the Mongo client's threads out of the workers
+    pdf_exporter.executor = ProcessPoolExecutor(
+        max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+async def shutdown_pdf_pool():
+    if pdf_exporter.executor is not None:
+        pdf_exporter.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def shutdown_event_writer():
+    await event_writer.stop()
 
 
-@app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    await client.close()
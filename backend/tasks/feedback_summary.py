@@ -4,7 +4,7 @@ from datetime import datetime, timedelta
 from pathlib import Path
 
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient
 
 ROOT_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(ROOT_DIR / ".env")
@@ -12,7 +12,7 @@ load_dotenv(ROOT_DIR / ".env")
 MONGO_URL = os.environ.get("MONGO_URL")
 DB_NAME = os.environ.get("DB_NAME")
 
-client = AsyncIOMotorClient(MONGO_URL) if MONGO_URL else None
+client = AsyncMongoClient(MONGO_URL) if MONGO_URL else None
 db = client[DB_NAME] if client and DB_NAME else None
 
 
@@ -28,7 +28,8 @@ async def aggregate_feedback() -> None:
         {"$group": {"_id": "$helpful", "count": {"$sum": 1}}},
     ]
 
-    results = await db.decision_feedback.aggregate(pipeline).to_list(length=10)
+    cursor = await db.decision_feedback.aggregate(pipeline)
+    results = await cursor.to_list(length=10)
     total = sum(r["count"] for r in results)
     helpful = next((r["count"] for r in results if r["_id"]), 0)
     unhelpful = next((r["count"] for r in results if not r["_id"]), 0)
@@ -0,0 +1,119 @@
+import os
+import sys
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "choicepilot_test")
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import server  # noqa: E402
+from monitoring_service import SecurityMonitor  # noqa: E402
+
+# nginx forwards every /api request from this address
+PROXY_ADDRESS = ("127.0.0.1", 51000)
+PASSWORD = "correct horse"
+
+
+def build_app() -> ProxyHeadersMiddleware:
+    """An auth-like endpoint behind uvicorn's proxy header handling, as deployed"""
+    app = FastAPI()
+
+    @app.post("/login")
+    async def login(request: Request, email: str, password: str):
+        await server.enforce_auth_rate_limit(request, email)
+        if password != PASSWORD:
+            await server.security_monitor.record_attempt(
+                "auth", f"email:{email.lower()}"
+            )
+            raise HTTPException(401, "Invalid email or password")
+        return {"ok": True}
+
+    return ProxyHeadersMiddleware(app, trusted_hosts="127.0.0.1")
+
+
+class AuthRateLimitTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        monitor = SecurityMonitor(MagicMock(), MagicMock(), writer=MagicMock())
+        monitor.log_security_event = AsyncMock()
+        self.monitor = monitor
+        patcher = patch.object(server, "security_monitor", monitor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limit = monitor.RATE_LIMITS["auth"]["limit"]
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=build_app(), client=PROXY_ADDRESS),
+            base_url="http://testserver",
+        )
+        self.addAsyncCleanup(self.client.aclose)
+
+    async def login(self, email: str, client_ip: str, password: str = "wrong") -> int:
+        response = await self.client.post(
+            "/login",
+            params={"email": email, "password": password},
+            headers={"X-Forwarded-For": client_ip},
+        )
+        return response.status_code
+
+    async def test_different_emails_via_same_proxy_are_not_throttled_together(self):
+        for _ in range(self.limit):
+            self.assertEqual(await self.login("alice@example.com", "203.0.113.5"), 401)
+        self.assertEqual(await self.login("alice@example.com", "203.0.113.5"), 429)
+
+        # Same proxy, different client and email: a separate bucket
+        self.assertEqual(await self.login("bob@example.com", "198.51.100.7"), 401)
+
+    async def test_one_client_is_still_limited_across_emails(self):
+        for i in range(self.limit):
+            self.assertEqual(
+                await self.login(f"user{i}@example.com", "203.0.113.5"), 401
+            )
+        self.assertEqual(await self.login("other@example.com", "203.0.113.5"), 429)
+
+    async def test_successful_logins_do_not_count_against_the_email(self):
+        for i in range(self.limit + 1):
+            self.assertEqual(
+                await self.login("alice@example.com", f"203.0.113.{i}", PASSWORD),
+                200,
+            )
+        self.assertNotIn("auth:email:alice@example.com", self.monitor.rate_limits)
+
+    async def test_failed_logins_lock_the_email_across_clients(self):
+        for i in range(self.limit):
+            self.assertEqual(
+                await self.login("alice@example.com", f"203.0.113.{i}"), 401
+            )
+        self.assertEqual(
+            await self.login("alice@example.com", "198.51.100.7", PASSWORD), 429
+        )
+
+    async def test_expired_keys_are_evicted(self):
+        window = self.monitor.RATE_LIMITS["auth"]["window"]
+        with patch("monitoring_service.time.time", return_value=1000.0):
+            await self.monitor.record_attempt("auth", "email:alice@example.com")
+        self.assertIn("auth:email:alice@example.com", self.monitor.rate_limits)
+
+        with patch("monitoring_service.time.time", return_value=1001.0 + window):
+            self.assertTrue(
+                await self.monitor.is_within_rate_limit(
+                    "auth", "email:alice@example.com"
+                )
+            )
+        self.assertNotIn("auth:email:alice@example.com", self.monitor.rate_limits)
+
+    async def test_key_count_is_bounded(self):
+        self.monitor.MAX_RATE_LIMIT_KEYS = 3
+        for i in range(5):
+            await self.monitor.record_attempt("auth", f"email:user{i}@example.com")
+        self.assertEqual(
+            list(self.monitor.rate_limits),
+            [f"auth:email:user{i}@example.com" for i in range(2, 5)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()